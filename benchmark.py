@@ -0,0 +1,190 @@
+import os
+import sys
+import json
+import time
+import platform
+import xml.etree.ElementTree as ET
+from metadata_stream import MetadataStreamParser, index_objects
+from multi_source import SourceProcessor
+from parser_backends import available_backends, create_backend
+from rtp import FrameReassembler, parse_rtp_header
+from synthetic_metadata import SceneGenerator, packetize, RTP_CLOCK_RATE
+
+# Throughput benchmark of the metadata hot path on synthetic scenes. GStreamer is not needed, the
+# stages are driven with RTP packets from synthetic_metadata.py. SourceProcessor is the parse/track/pack
+# code main3.py and multi_source.py run.
+# Each parser backend is timed on its own, after checking it returns the same records as the first one.
+#
+#   python3 benchmark.py                       sweep and write benchmark_results/<timestamp>.json
+#   python3 benchmark.py baseline.json         also compare against an earlier result
+
+BENCH_OBJECT_COUNTS = [int(count) for count in os.getenv("BENCH_OBJECT_COUNTS", "1,10,50,100,250,500").split(",")]
+BENCH_FRAMES = int(os.getenv("BENCH_FRAMES", "200"))
+BENCH_RESULTS_DIR = os.getenv("BENCH_RESULTS_DIR", "benchmark_results")
+BENCH_REGRESSION = float(os.getenv("BENCH_REGRESSION", "0.10"))  # Flag stages whose frames/sec dropped by more than this
+
+
+def _summarize(latencies_ns):
+    latencies_ns.sort()
+    count = len(latencies_ns)
+    total_ns = sum(latencies_ns)
+    return {
+        "frames": count,
+        "frames_per_sec": count / (total_ns / 1e9) if total_ns else 0.0,
+        "mean_us": total_ns / count / 1e3,
+        "p50_us": latencies_ns[count // 2] / 1e3,
+        "p99_us": latencies_ns[min(count - 1, int(count * 0.99))] / 1e3,
+        "max_us": latencies_ns[-1] / 1e3,
+    }
+
+
+def _frames(object_count, frame_count):
+    # Pregenerate (document, packets) pairs so generation cost stays out of the measurements
+    scene = SceneGenerator(object_count)
+    frames = []
+    sequence_number = 0
+    for frame_index in range(frame_count):
+        document = scene.next_frame()
+        packets = packetize(document, sequence_number, frame_index * RTP_CLOCK_RATE // 10)
+        sequence_number += len(packets)
+        frames.append((document, packets))
+    return frames
+
+
+def bench_reassembly(frames):
+    reassembler = FrameReassembler()
+    latencies = []
+    for _, packets in frames:
+        started = time.perf_counter_ns()
+        for packet in packets:
+            sequence_number, timestamp, marker, ssrc, payload_start, payload_end = parse_rtp_header(packet)
+            with memoryview(packet)[payload_start:payload_end] as payload_body:
+                reassembler.push(sequence_number, timestamp, marker, payload_body, ssrc)
+        latencies.append(time.perf_counter_ns() - started)
+    return latencies
+
+
+def bench_streaming_parse(frames):
+    parser = MetadataStreamParser()
+    latencies = []
+    for _, packets in frames:
+        started = time.perf_counter_ns()
+        for packet in packets:
+            _, _, _, _, payload_start, payload_end = parse_rtp_header(packet)
+            with memoryview(packet)[payload_start:payload_end] as payload_body:
+                parser.feed(payload_body, lambda notification_message: None)
+        latencies.append(time.perf_counter_ns() - started)
+    return latencies
+
+
+def bench_extract_objects(frames):
+    roots = [ET.fromstring(document) for document, _ in frames]
+    latencies = []
+    for root in roots:
+        started = time.perf_counter_ns()
+        index_objects(root)
+        latencies.append(time.perf_counter_ns() - started)
+    return latencies
+
+
+def bench_parser_backend(frames, backend):
+    # Returns the latencies and the parsed frames, which must match across backends
+    latencies = []
+    parsed_frames = []
+    for document, _ in frames:
+        started = time.perf_counter_ns()
+        parsed = backend.parse(document)
+        latencies.append(time.perf_counter_ns() - started)
+        parsed_frames.append(parsed)
+    return latencies, parsed_frames
+
+
+def bench_process_and_pack(frames):
+    # process_metadata and flush share tracker state, so they are timed in the same run
+    processor = SourceProcessor("bench", lambda message: None)
+    process_latencies = []
+    pack_latencies = []
+    for document, _ in frames:
+        started = time.perf_counter_ns()
+        processor.process_metadata(document)
+        process_latencies.append(time.perf_counter_ns() - started)
+
+        started = time.perf_counter_ns()
+        processor.flush()
+        pack_latencies.append(time.perf_counter_ns() - started)
+    return process_latencies, pack_latencies
+
+
+def run(object_counts, frame_count):
+    scenes = []
+    for object_count in object_counts:
+        frames = _frames(object_count, frame_count)
+        process_latencies, pack_latencies = bench_process_and_pack(frames)
+        stages = {
+            "reassembly": _summarize(bench_reassembly(frames)),
+            "streaming_parse": _summarize(bench_streaming_parse(frames)),
+            "process_metadata": _summarize(process_latencies),
+            "extract_objects": _summarize(bench_extract_objects(frames)),
+            "sdsm_pack": _summarize(pack_latencies),
+        }
+        reference = None
+        for backend_name in available_backends():
+            latencies, parsed_frames = bench_parser_backend(frames, create_backend(backend_name))
+            if reference is None:
+                reference = parsed_frames
+            elif parsed_frames != reference:
+                raise RuntimeError(f"Parser backend {backend_name} disagrees with {available_backends()[0]} "
+                                   f"on the {object_count} object scene")
+            stages[f"parse_{backend_name}"] = _summarize(latencies)
+        scenes.append({
+            "objects": object_count,
+            "frame_bytes": sum(len(document) for document, _ in frames) // len(frames),
+            "packets_per_frame": sum(len(packets) for _, packets in frames) / len(frames),
+            "stages": stages,
+        })
+        print(f"{object_count:>4} objects: " + "  ".join(
+            f"{name} {stage['frames_per_sec']:.0f}/s p99 {stage['p99_us']:.0f}us" for name, stage in stages.items()), flush=True)
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "parser_backends": available_backends(),
+        "frames_per_scene": frame_count,
+        "scenes": scenes,
+    }
+
+
+def compare(results, baseline):
+    # Returns a line for every stage/scene whose frames/sec dropped by more than BENCH_REGRESSION
+    regressions = []
+    baseline_scenes = {scene["objects"]: scene for scene in baseline["scenes"]}
+    for scene in results["scenes"]:
+        baseline_scene = baseline_scenes.get(scene["objects"])
+        if baseline_scene is None:
+            continue
+        for name, stage in scene["stages"].items():
+            baseline_stage = baseline_scene["stages"].get(name)
+            if not baseline_stage or not baseline_stage["frames_per_sec"]:
+                continue
+            change = stage["frames_per_sec"] / baseline_stage["frames_per_sec"] - 1
+            if change < -BENCH_REGRESSION:
+                regressions.append(f"{name} @ {scene['objects']} objects: {baseline_stage['frames_per_sec']:.0f}/s -> "
+                                   f"{stage['frames_per_sec']:.0f}/s ({change:+.0%})")
+    return regressions
+
+
+if __name__ == "__main__":
+    results = run(BENCH_OBJECT_COUNTS, BENCH_FRAMES)
+
+    os.makedirs(BENCH_RESULTS_DIR, exist_ok=True)
+    output_path = os.path.join(BENCH_RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(output_path, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"Results written to {output_path}", flush=True)
+
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as baseline_file:
+            regressions = compare(results, json.load(baseline_file))
+        for regression in regressions:
+            print("Regression:", regression, flush=True)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,78 @@
+import mmap
+import struct
+import time
+
+# Capture file: 8 byte magic followed by records of
+#   arrival time in ns since the first packet (u64), packet length (u32), raw RTP packet
+CAPTURE_MAGIC = b"RTPCAP01"
+RECORD_HEADER = struct.Struct("<QI")
+
+
+class CaptureWriter:
+    # Appends raw RTP packets from the appsink to a capture file
+
+    def __init__(self, path):
+        self._file = open(path, "wb")
+        self._file.write(CAPTURE_MAGIC)
+        self._start_ns = None
+        self.packets = 0
+
+    def write(self, packet, arrival_ns=None):
+        if arrival_ns is None:
+            arrival_ns = time.monotonic_ns()
+        if self._start_ns is None:
+            self._start_ns = arrival_ns
+        self._file.write(RECORD_HEADER.pack(arrival_ns - self._start_ns, len(packet)))
+        self._file.write(packet)
+        self.packets += 1
+
+    def close(self):
+        self._file.close()
+
+
+class CaptureReader:
+    # Memory-maps a capture file, iterating yields (arrival_ns, packet) with packet a memoryview into the map
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        if self._view[:len(CAPTURE_MAGIC)] != CAPTURE_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not an RTP capture file")
+
+    def __iter__(self):
+        offset = len(CAPTURE_MAGIC)
+        end = len(self._view)
+        while offset + RECORD_HEADER.size <= end:
+            arrival_ns, length = RECORD_HEADER.unpack_from(self._view, offset)
+            offset += RECORD_HEADER.size
+            if offset + length > end:
+                break  # Truncated last record, the recorder was killed mid-write
+            yield arrival_ns, self._view[offset:offset + length]
+            offset += length
+
+    def close(self):
+        self._view.release()
+        self._map.close()
+        self._file.close()
+
+
+def replay(path, handle_packet, realtime=True, speed=1.0):
+    # Feeds every captured packet to handle_packet, either at the recorded pace or as fast as possible.
+    # Returns the number of packets replayed.
+    reader = CaptureReader(path)
+    packets = 0
+    try:
+        start_ns = time.monotonic_ns()
+        for arrival_ns, packet in reader:
+            if realtime:
+                delay = (start_ns + arrival_ns / speed - time.monotonic_ns()) / 1e9
+                if delay > 0:
+                    time.sleep(delay)
+            with packet:
+                handle_packet(packet)
+            packets += 1
+    finally:
+        reader.close()
+    return packets
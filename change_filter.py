@@ -0,0 +1,75 @@
+import math
+import time
+from sdsm import HEADER, OBJECT_RECORD
+
+METERS_PER_DEGREE = 111320.0  # Along a meridian, close enough for change thresholds
+HEADING_UNITS_PER_TURN = 28800  # 360 degrees in 0.0125 degree units
+
+
+class ChangeFilter:
+    # Delta publishing: an object is only sent again once its position, speed or heading moved past a
+    # threshold since it was last sent, or when keepalive seconds have passed. Works on the column
+    # lists that are handed to SdsmEncoder.add_objects.
+
+    def __init__(self, position_threshold, speed_threshold, heading_threshold, keepalive):
+        self.position_threshold = position_threshold  # meters
+        self.speed_threshold = speed_threshold  # m/s
+        self.heading_threshold = heading_threshold / 0.0125  # degrees in, heading units kept
+        self.keepalive = keepalive  # seconds
+        self.sent_objects = 0
+        self.suppressed_objects = 0
+        self.suppressed_messages = 0
+        self._last_sent = {}  # object_id -> (sent_at, latitude, longitude, speed, heading)
+        self._last_pruned = time.monotonic()
+
+    def apply(self, object_ids, times_ms, latitudes, longitudes, elevations, speeds, headings, *extra_columns):
+        # Returns the same seven columns, and any extra columns, with unchanged objects left out
+        now = time.monotonic()
+        keep = []
+        for index, object_id in enumerate(object_ids):
+            latitude = float(latitudes[index])
+            longitude = float(longitudes[index])
+            speed = float(speeds[index])
+            heading = headings[index]
+            last = self._last_sent.get(object_id)
+            if last is not None and now - last[0] < self.keepalive and not self._changed(last, latitude, longitude, speed, heading):
+                continue
+            self._last_sent[object_id] = (now, latitude, longitude, speed, heading)
+            keep.append(index)
+
+        self.sent_objects += len(keep)
+        self.suppressed_objects += len(object_ids) - len(keep)
+        if not keep:
+            self.suppressed_messages += 1  # The caller skips the whole message
+        if now - self._last_pruned >= self.keepalive:
+            self._prune(now)
+        columns = (object_ids, times_ms, latitudes, longitudes, elevations, speeds, headings) + extra_columns
+        if len(keep) == len(object_ids):
+            return columns
+        return tuple([column[index] for index in keep] for column in columns)
+
+    def _changed(self, last, latitude, longitude, speed, heading):
+        _, last_latitude, last_longitude, last_speed, last_heading = last
+        north = (latitude - last_latitude) * METERS_PER_DEGREE
+        east = (longitude - last_longitude) * METERS_PER_DEGREE * math.cos(math.radians(latitude))
+        if north * north + east * east >= self.position_threshold * self.position_threshold:
+            return True
+        if abs(speed - last_speed) >= self.speed_threshold:
+            return True
+        turn = abs(heading - last_heading) % HEADING_UNITS_PER_TURN
+        return min(turn, HEADING_UNITS_PER_TURN - turn) >= self.heading_threshold
+
+    def _prune(self, now):
+        # Objects still in view are sent at least every keepalive, anything older has left
+        self._last_pruned = now
+        for object_id in [object_id for object_id, last in self._last_sent.items() if now - last[0] > 2 * self.keepalive]:
+            del self._last_sent[object_id]
+
+    def stats(self):
+        return {
+            "sent_objects": self.sent_objects,
+            "suppressed_objects": self.suppressed_objects,
+            "suppressed_messages": self.suppressed_messages,
+            "saved_bytes": self.suppressed_objects * OBJECT_RECORD.size + self.suppressed_messages * HEADER.size,
+            "remembered_objects": len(self._last_sent),
+        }
@@ -0,0 +1,75 @@
+import math
+
+try:
+    import numpy as np
+except ImportError:  # Scalar fallback, one object at a time
+    np = None
+
+
+def calculate_bearing(lat1, lon1, lat2, lon2):
+    try:
+        
+        # Convert degrees to radians
+        lat1 = math.radians(float(lat1))
+        lon1 = math.radians(float(lon1))
+        lat2 = math.radians(float(lat2))
+        lon2 = math.radians(float(lon2))
+        
+        # Calculate differences
+        delta_lon = lon2 - lon1
+        
+        # Calculate bearing
+        x = math.sin(delta_lon) * math.cos(lat2)
+        y = math.cos(lat1) * math.sin(lat2) - (math.sin(lat1) * math.cos(lat2) * math.cos(delta_lon))
+        initial_bearing = math.atan2(x, y)
+        
+        # Convert radians to degrees
+        initial_bearing = math.degrees(initial_bearing)
+        
+        # Normalize bearing to 0-360/0.0125
+        compass_bearing = ((initial_bearing + 360) % 360) / 0.0125
+        
+        return abs(int(compass_bearing))
+
+    except Exception as e:
+        print("An error occurred:", str(e), flush=True)
+        return None
+
+
+def calculate_bearings(lat1, lon1, lat2, lon2):
+    # calculate_bearing for every object of a frame in one pass, sequences of degrees in (floats or
+    # numeric strings), bearings out in 0.0125 degree units
+    if np is None:
+        return [calculate_bearing(*positions) for positions in zip(lat1, lon1, lat2, lon2)]
+    lat1 = np.radians(np.asarray(lat1, dtype=np.float64))
+    lon1 = np.radians(np.asarray(lon1, dtype=np.float64))
+    lat2 = np.radians(np.asarray(lat2, dtype=np.float64))
+    lon2 = np.radians(np.asarray(lon2, dtype=np.float64))
+    delta_lon = lon2 - lon1
+    cos_lat2 = np.cos(lat2)
+    x = np.sin(delta_lon) * cos_lat2
+    y = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * cos_lat2 * np.cos(delta_lon)
+    compass_bearing = ((np.degrees(np.arctan2(x, y)) + 360) % 360) / 0.0125
+    finite = np.isfinite(compass_bearing)
+    if finite.all():
+        return compass_bearing.astype(np.int64).tolist()
+    # A missing or non-numeric position gives None, as calculate_bearing does
+    return [int(bearing) if is_finite else None for bearing, is_finite in zip(compass_bearing.tolist(), finite.tolist())]
+
+
+def position_headings(current_x, current_y, previous_x, previous_y):
+    # Direction of travel in degrees from the previous to the current centre of gravity, for many objects at once
+    if np is None:
+        return [math.degrees(math.atan2(y - py, x - px))
+                for x, y, px, py in zip(current_x, current_y, previous_x, previous_y)]
+    return np.degrees(np.arctan2(np.subtract(current_y, previous_y), np.subtract(current_x, previous_x))).tolist()
+
+
+def heading_units(headings):
+    # Headings in degrees to the SDSM 0.0125 degree unit, truncated like int()
+    if np is None:
+        return [int(float(heading) / 0.0125) for heading in headings]
+    units = np.asarray(headings, dtype=np.float64) / 0.0125
+    if not np.isfinite(units).all():
+        raise ValueError("Heading is missing or not a number")  # int() raises on the scalar path too
+    return units.astype(np.int64).tolist()
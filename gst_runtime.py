@@ -0,0 +1,273 @@
+import threading
+import time
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib, Gst
+from metrics import OUTAGE_BUCKETS
+
+PULL_TIMEOUT = 0.1  # Seconds an idle AppsinkPuller blocks in try-pull-sample before checking for stop
+DATA_TIMEOUT = 5.0  # Seconds without an RTP packet before PipelineSupervisor treats the stream as lost
+RECONNECT_BACKOFF = 0.5  # First reconnect delay in seconds, doubled after every failed attempt
+RECONNECT_BACKOFF_MAX = 30.0
+
+
+def build_pipeline(rtsp_url, latency_ms=None, max_buffers=0, drop=False, sync=True):
+    # latency_ms sets both rtspsrc's and the rtpjitterbuffer's latency, None keeps the element defaults.
+    # max_buffers bounds the appsink queue (0 is unbounded), with drop the oldest buffer is discarded
+    # when it is full instead of blocking the streaming thread.
+    latency = f" latency={latency_ms}" if latency_ms is not None else ""
+    appsink = f"appsink name=appsink max-buffers={max_buffers} drop={str(drop).lower()} sync={str(sync).lower()}"
+    pipeline_str = f"rtspsrc location={rtsp_url}{latency} ! application/x-rtp, media=application, payload=107, encoding-name=VND.ONVIF.METADATA! rtpjitterbuffer{latency} ! {appsink}"
+    return Gst.parse_launch(pipeline_str)
+
+
+class AppsinkPuller(threading.Thread):
+    # Pull-mode ingest: instead of a new-sample signal (and a trip into Python) per RTP packet, a
+    # dedicated thread waits in try-pull-sample and then drains every sample already queued in the
+    # appsink before waiting again. The batch sizes show how far the appsink queue has grown.
+    # handle_buffer(buffer, appsink) is told which appsink the buffer came from.
+
+    def __init__(self, appsink, handle_buffer, timeout=PULL_TIMEOUT, name="appsink-puller"):
+        super().__init__(name=name, daemon=True)
+        self.appsink = appsink
+        self.handle_buffer = handle_buffer
+        self.timeout = timeout
+        self.wakeups = 0
+        self.samples = 0
+        self.max_batch = 0
+        self.errors = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        timeout_ns = int(self.timeout * Gst.SECOND)
+        while not self._stopped.is_set():
+            appsink = self.appsink  # Swapped by PipelineSupervisor when it rebuilds the pipeline
+            started = time.monotonic()
+            sample = appsink.emit("try-pull-sample", timeout_ns) if appsink is not None else None
+            if sample is None:
+                # Timed out, or returned at once because the appsink is not playing, reached EOS or is gone
+                self._stopped.wait(max(0.0, self.timeout - (time.monotonic() - started)))
+                continue
+            batch = 0
+            while sample is not None:
+                try:
+                    self.handle_buffer(sample.get_buffer(), appsink)
+                except Exception as e:
+                    self.errors += 1
+                    print(f"An error occurred in {self.name}: {e}", flush=True)
+                batch += 1
+                sample = appsink.emit("try-pull-sample", 0)
+            self.wakeups += 1
+            self.samples += batch
+            self.max_batch = max(self.max_batch, batch)
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self.join(timeout)
+
+    def stats(self):
+        appsink = self.appsink
+        return {
+            "wakeups": self.wakeups,
+            "samples": self.samples,
+            "mean_batch": self.samples / self.wakeups if self.wakeups else 0.0,
+            "max_batch": self.max_batch,
+            "errors": self.errors,
+            "max_buffers": appsink.get_property("max-buffers") if appsink is not None else 0,
+        }
+
+
+class PipelineSupervisor:
+    # Keeps an RTSP pipeline alive. When the bus reports ERROR or EOS, or no RTP packet arrived for
+    # data_timeout seconds, the pipeline is torn down and rebuilt with build() after an exponential
+    # backoff, until packets flow again. Every packet goes through handle_buffer, on the streaming
+    # thread or on an AppsinkPuller when pull is set. on_resumed(outage_seconds) runs on the packet
+    # thread before the first packet after an outage, so callers can decide what state to keep.
+
+    def __init__(self, build, handle_buffer, pull=False, data_timeout=DATA_TIMEOUT, backoff=RECONNECT_BACKOFF,
+                 backoff_max=RECONNECT_BACKOFF_MAX, on_resumed=None, metrics_registry=None, loop=None, name="rtsp"):
+        self.build = build
+        self.handle_buffer = handle_buffer
+        self.data_timeout = data_timeout
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.on_resumed = on_resumed
+        self.loop = loop or GLib.MainLoop()
+        self.name = name
+        self.appsink_puller = AppsinkPuller(None, self._handle_buffer, name=f"appsink-puller-{name}") if pull else None
+        self.pipeline = None
+        self._appsink = None  # Appsink of the live session, buffers from any other one are dropped
+        self.disconnections = 0
+        self.reconnect_attempts = 0
+        self.recoveries = 0
+        self.last_outage_seconds = 0.0
+        self._bus = None
+        self._next_backoff = backoff
+        self._reconnect_pending = False
+        self._stopped = False
+        self._connected_at = 0.0
+        self._last_data = 0.0
+        self._outage_started = None  # Last packet before the stream was lost
+        self._failed_at = None  # When the loss was detected
+        self._resume_lock = threading.Lock()
+        self._outage_histogram = None
+        self._reconnect_histogram = None
+        if metrics_registry is not None:
+            self._outage_histogram = metrics_registry.histogram(
+                "rtsp_metadata_outage_seconds", "Time from the last packet before a stream loss to the first packet after it", OUTAGE_BUCKETS)
+            self._reconnect_histogram = metrics_registry.histogram(
+                "rtsp_metadata_reconnect_seconds", "Time from detecting a stream loss to the first packet after it", OUTAGE_BUCKETS)
+            metrics_registry.add_stats("rtsp_metadata_stream", self.stats)
+            if self.appsink_puller is not None:
+                metrics_registry.add_stats("rtsp_metadata_appsink", self.appsink_puller.stats)
+
+    def start(self):
+        # Connects and arms the data watchdog on self.loop, which the caller runs
+        if self.appsink_puller is not None:
+            self.appsink_puller.start()
+        self._connect()
+        if self.data_timeout > 0:
+            GLib.timeout_add(max(1, int(min(1.0, self.data_timeout / 2) * 1000)), self._check_data)
+
+    def run(self):
+        # Blocks in the GLib main loop until stop() or Ctrl+C
+        self.start()
+        try:
+            self.loop.run()
+        finally:
+            self.stop()
+
+    def stop(self):
+        self._stopped = True
+        self.loop.quit()
+        self._teardown()
+        if self.appsink_puller is not None:
+            self.appsink_puller.stop()
+
+    def _connect(self):
+        self._reconnect_pending = False
+        self._connected_at = time.monotonic()
+        try:
+            pipeline = self.build()
+            appsink = pipeline.get_by_name("appsink")
+            self._appsink = appsink
+            if self.appsink_puller is not None:
+                self.appsink_puller.appsink = appsink
+            else:
+                appsink.set_property("emit-signals", True)
+                appsink.connect("new-sample", self._on_new_sample)
+            bus = pipeline.get_bus()
+            bus.add_signal_watch()
+            bus.connect("message", self._on_bus_message, pipeline)
+            self.pipeline, self._bus = pipeline, bus
+            if pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+                self._fail("pipeline refused to start")
+        except Exception as e:
+            self._fail(f"pipeline could not be built: {e}")
+
+    def _teardown(self):
+        pipeline, bus = self.pipeline, self._bus
+        self.pipeline = self._bus = None
+        if self.appsink_puller is not None:
+            self.appsink_puller.appsink = None
+        if pipeline is not None:
+            pipeline.set_state(Gst.State.NULL)
+        if bus is not None:
+            bus.remove_signal_watch()
+
+    def _fail(self, reason):
+        # Runs on the GLib main loop, schedules a single reconnect however many failures are reported
+        if self._reconnect_pending or self._stopped:
+            return
+        now = time.monotonic()
+        with self._resume_lock:
+            # Ends the session before the teardown, so buffers still draining from the old pipeline
+            # can neither end the outage nor reach handle_buffer
+            self._appsink = None
+            self._reconnect_pending = True
+            if self._failed_at is None:
+                self.disconnections += 1
+                self._failed_at = now
+                self._outage_started = self._last_data or now
+        print(f"[{self.name}] Stream lost ({reason}), reconnecting in {self._next_backoff:.1f}s", flush=True)
+        self._teardown()
+        GLib.timeout_add(int(self._next_backoff * 1000), self._reconnect)
+        self._next_backoff = min(self._next_backoff * 2, self.backoff_max)
+
+    def _reconnect(self):
+        if not self._stopped:
+            self.reconnect_attempts += 1
+            self._connect()
+        return False  # One-shot timeout
+
+    def _check_data(self):
+        if self._stopped:
+            return False
+        if not self._reconnect_pending and time.monotonic() - max(self._last_data, self._connected_at) > self.data_timeout:
+            self._fail(f"no data for {self.data_timeout:g}s")
+        return True
+
+    def _on_bus_message(self, bus, message, pipeline):
+        if pipeline is not self.pipeline:
+            return True  # Late message from a pipeline that was already torn down
+        if message.type == Gst.MessageType.EOS:
+            self._fail("end of stream")
+        elif message.type == Gst.MessageType.ERROR:
+            error, debug = message.parse_error()
+            self._fail(f"error from {message.src.get_name()}: {error.message}")
+        elif message.type == Gst.MessageType.WARNING:
+            warning, debug = message.parse_warning()
+            print(f"[{self.name}] Pipeline warning from {message.src.get_name()}: {warning.message}", flush=True)
+        elif message.type == Gst.MessageType.STATE_CHANGED and message.src == pipeline:
+            old_state, new_state, _pending = message.parse_state_changed()
+            print(f"[{self.name}] Pipeline state changed from {old_state.value_nick} to {new_state.value_nick}", flush=True)
+        return True
+
+    def _on_new_sample(self, appsink):
+        try:
+            sample = appsink.emit("pull-sample")
+            if sample:
+                self._handle_buffer(sample.get_buffer(), appsink)
+        except Exception as e:
+            print(f"[{self.name}] An error occurred in on_new_sample: {e}", flush=True)
+        return Gst.FlowReturn.OK
+
+    def _handle_buffer(self, buffer, appsink):
+        if appsink is not self._appsink:
+            return  # Still draining from a pipeline that was torn down, its session is over
+        now = time.monotonic()
+        if self._failed_at is not None and not self._resume(appsink, now):
+            return
+        self._last_data = now
+        self.handle_buffer(buffer)
+
+    def _resume(self, appsink, now):
+        # Returns False when the session ended while the buffer was on its way
+        with self._resume_lock:
+            if appsink is not self._appsink:
+                return False
+            if self._failed_at is None:
+                return True
+            outage = now - self._outage_started
+            reconnect = now - self._failed_at
+            self._failed_at = self._outage_started = None
+        self._next_backoff = self.backoff
+        self.recoveries += 1
+        self.last_outage_seconds = outage
+        if self._outage_histogram is not None:
+            self._outage_histogram.observe(outage)
+            self._reconnect_histogram.observe(reconnect)
+        print(f"[{self.name}] Stream resumed after {outage:.1f}s without data ({reconnect:.1f}s to reconnect)", flush=True)
+        if self.on_resumed is not None:
+            self.on_resumed(outage)
+        return True
+
+    def stats(self):
+        return {
+            "connected": 0 if self._failed_at is not None else 1,
+            "disconnections": self.disconnections,
+            "reconnect_attempts": self.reconnect_attempts,
+            "recoveries": self.recoveries,
+            "last_outage_seconds": self.last_outage_seconds,
+        }
+
@@ -1,156 +1,229 @@
 import os
+import threading
 import json
 import xml.etree.ElementTree as ET
-import math
 import gi
 gi.require_version('Gst', '1.0')
 from gi.repository import Gst
 import socket
-from datetime import datetime
-import struct
 import time
+from metadata_stream import FramePrefilter, MetadataStreamParser, notification_object_ids, notification_topic
+from parser_backends import create_backend
+from tracker import ObjectTracker
+from udp_sender import UdpSender, parse_destinations
+from sdsm import OBJECT_TYPE_HUMAN, SdsmEncoder
+from gst_runtime import PipelineSupervisor, build_pipeline
+from stages import DROP_OLDEST, FrameQueue, StageWorker
+from capture import CaptureWriter, replay
+from geo import heading_units, position_headings
+from utc_time import UtcTimeCodec
+from change_filter import ChangeFilter
+from shm_ring import ShmRingWriter
+from metrics import MetricsRegistry, PipelineMetrics, start_metrics_server
+from rtp import FRAGMENT_FEED, FRAGMENT_RESET, FrameReassembler, map_buffer, parse_rtp_header
 
 Gst.init(None)
-frame_sample_buffer = []  # Buffer to keep samples until the entire frame is available
-object_tracking_buffer = []  # Buffer to keep track of objects
-object_info_tracking_stack = {}
+TRACKER_TTL = float(os.getenv("TRACKER_TTL", "10"))  # Seconds unseen before an object whose LeavingField was lost is dropped
+MAX_TRACKED_OBJECTS = int(os.getenv("MAX_TRACKED_OBJECTS", "1024"))
+object_tracker = ObjectTracker(TRACKER_TTL, MAX_TRACKED_OBJECTS)  # Objects currently in the field of view
+tracker_lock = threading.Lock()  # With STAGED_PIPELINE frames update the tracker on the worker while a reconnect resumes or clears it
 UDP_IP = '127.0.0.1' 
 UDP_PORT = 3157 
+UDP_DESTINATIONS = os.getenv("UDP_DESTINATIONS", f"{UDP_IP}:{UDP_PORT}")  # Comma separated host:port list
+udp_sender = UdpSender(parse_destinations(UDP_DESTINATIONS))  # Long-lived sockets reused for every message
+SHM_RING_PATH = os.getenv("SHM_RING_PATH")  # Also write every SDSM message to a shared-memory ring for local consumers, e.g. /dev/shm/sdsm_ring
+SHM_RING_SLOTS = int(os.getenv("SHM_RING_SLOTS", "64"))  # Messages kept in the ring
+shm_ring = ShmRingWriter(SHM_RING_PATH, SHM_RING_SLOTS) if SHM_RING_PATH else None
+STREAMING_PARSE = os.getenv("STREAMING_PARSE", "0") == "1"  # Parse fragments incrementally as they arrive
+ZERO_COPY_RTP = os.getenv("ZERO_COPY_RTP", "0") == "1"  # Map RTP buffers read-only and feed the incremental parser directly
+STAGED_PIPELINE = os.getenv("STAGED_PIPELINE", "0") == "1"  # Hand reassembled frames to a worker thread instead of parsing on the streaming thread
+FRAME_QUEUE_SIZE = int(os.getenv("FRAME_QUEUE_SIZE", "8"))
+FRAME_QUEUE_POLICY = os.getenv("FRAME_QUEUE_POLICY", DROP_OLDEST)  # drop-oldest, drop-newest or latest
+MAX_FRAME_SIZE = int(os.getenv("MAX_FRAME_SIZE", str(1024 * 1024)))  # Frames larger than this are dropped unparsed
+APPSINK_PULL = os.getenv("APPSINK_PULL", "0") == "1"  # Drain the appsink from a puller thread instead of a signal per packet
+JITTERBUFFER_LATENCY_MS = os.getenv("JITTERBUFFER_LATENCY_MS")  # rtspsrc/rtpjitterbuffer latency, unset keeps the GStreamer defaults
+APPSINK_MAX_BUFFERS = int(os.getenv("APPSINK_MAX_BUFFERS", "0"))  # Appsink queue limit in packets, 0 is unbounded
+APPSINK_DROP = os.getenv("APPSINK_DROP", "0") == "1"  # Drop the oldest packet when the appsink queue is full instead of blocking
+APPSINK_SYNC = os.getenv("APPSINK_SYNC", "1") == "1"  # Hold packets until their running time, 0 hands them over on arrival
+RECONNECT_DATA_TIMEOUT = float(os.getenv("RECONNECT_DATA_TIMEOUT", "5"))  # Seconds without RTP packets before the pipeline is rebuilt, 0 only reacts to bus errors
+RECONNECT_BACKOFF_MS = int(os.getenv("RECONNECT_BACKOFF_MS", "500"))  # First reconnect delay, doubled after every failed attempt
+RECONNECT_BACKOFF_MAX_MS = int(os.getenv("RECONNECT_BACKOFF_MAX_MS", "30000"))
+RECONNECT_GRACE = float(os.getenv("RECONNECT_GRACE", "60"))  # Outages up to this many seconds keep the tracked objects
+pipeline_supervisor = None  # Rebuilds the RTSP pipeline when the stream is lost
+metadata_parser = MetadataStreamParser()
+PARSER_BACKEND = os.getenv("PARSER_BACKEND", "auto")  # etree, expat or lxml (when installed), auto takes expat
+metadata_backend = create_backend(PARSER_BACKEND)  # Parses whole frames, see parser_backends.py
+FRAME_PREFILTER = os.getenv("FRAME_PREFILTER", "0") == "1"  # Skip frames without notifications or published classes unparsed
+PREFILTER_CLASSES = os.getenv("PREFILTER_CLASSES", "Human").split(",")
+frame_prefilter = FramePrefilter(PREFILTER_CLASSES) if FRAME_PREFILTER else None
+sdsm_encoder = SdsmEncoder()  # Preallocated SDSM datagram buffer
+utc_time_codec = UtcTimeCodec()  # Frame UtcTime -> epoch ms as UTC, parsed once per distinct value
+DELTA_PUBLISHING = os.getenv("DELTA_PUBLISHING", "0") == "1"  # Resend an object only when it changed or its keepalive is due
+change_filter = ChangeFilter(float(os.getenv("DELTA_POSITION_M", "0.2")),
+                             float(os.getenv("DELTA_SPEED_MPS", "0.1")),
+                             float(os.getenv("DELTA_HEADING_DEG", "5")),
+                             int(os.getenv("DELTA_KEEPALIVE_MS", "1000")) / 1000) if DELTA_PUBLISHING else None
+frame_reassembler = FrameReassembler(MAX_FRAME_SIZE)  # Reassembles frames from RTP sequence number, timestamp and marker bit
+process_worker = None  # Parses and tracks frames when STAGED_PIPELINE is enabled
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # Prometheus text endpoint at /metrics, 0 disables it
+metrics_registry = MetricsRegistry()
+pipeline_metrics = PipelineMetrics(metrics_registry)  # Per-stage latency histograms and frame counters
+metrics_registry.add_stats("rtsp_metadata_rtp", frame_reassembler.stats)
+metrics_registry.add_stats("rtsp_metadata_tracker", object_tracker.stats)
+if shm_ring is not None:
+    metrics_registry.add_stats("rtsp_metadata_shm_ring", shm_ring.stats)
+if frame_prefilter is not None:
+    metrics_registry.add_stats("rtsp_metadata_prefilter", frame_prefilter.stats)
+metrics_registry.add_stats("rtsp_metadata_utc_time", utc_time_codec.stats)
+metrics_registry.add_stats("rtsp_metadata_sdsm", sdsm_encoder.stats, counters=("overflowed_objects",))
+if change_filter is not None:
+    metrics_registry.add_stats("rtsp_metadata_delta", change_filter.stats)
+metrics_registry.add_stats("rtsp_metadata_udp", udp_sender.stats)
+RECORD_RTP = os.getenv("RECORD_RTP")  # Capture file that every received RTP packet is appended to
+REPLAY_RTP = os.getenv("REPLAY_RTP")  # Capture file to process instead of the RTSP camera
+REPLAY_REALTIME = os.getenv("REPLAY_REALTIME", "1") == "1"  # Keep the recorded packet timing, otherwise as fast as possible
+capture_writer = None
 
-def on_new_sample(appsink):
-    try:
-        sample = appsink.emit("pull-sample")
-        if sample:
-            buffer = sample.get_buffer()
-            payload_size = buffer.get_size()
-            payload_data = buffer.extract_dup(0, payload_size)
-
-            rtp_header = payload_data[:12]
-            timestamp = int.from_bytes(rtp_header[4:8], byteorder='big')
-            sequence_number = int.from_bytes(rtp_header[2:4], byteorder='big')
-            payload_body = payload_data[12:]
-            decoded_data = payload_body.decode('UTF-8')
-            
-            if _is_complete_metadata_frame(decoded_data):
-                frame_sample_buffer.append(decoded_data)
-                combined_metadata = "".join(frame_sample_buffer)
-                frame_sample_buffer.clear()
-                _process_metadata(combined_metadata)
-            else:
-                frame_sample_buffer.append(decoded_data)
-    except Exception as e:
-        print(f"An error occurred in on_new_sample: {e}", flush=True)
-    return Gst.FlowReturn.OK
+# Tracking Notification Topics 
+entering_topic = "tns1:IVA/EnteringField/Entering_field"
+leaving_topic = "tns1:IVA/LeavingField/Leaving_field"
+infield_topc = "tns1:IVA/ObjectInField/Object_in_Field_1"
+
+def _process_buffer(buffer):
+    if ZERO_COPY_RTP:
+        with map_buffer(buffer, Gst.MapFlags.READ) as packet:
+            _process_rtp_packet(packet)
+    else:
+        _process_rtp_packet(buffer.extract_dup(0, buffer.get_size()))
 
-def _is_complete_metadata_frame(data):
-    return data.endswith("</tt:MetadataStream>")
+def _on_stream_resumed(outage):
+    # Runs before the first packet after a reconnect, which belongs to a new RTP session. After a
+    # short outage the tracked objects are kept and the outage does not count against their TTL,
+    # after a longer one the camera has most likely restarted and renumbered its objects.
+    frame_reassembler.resync()
+    metadata_parser.reset()
+    with tracker_lock:
+        if outage <= RECONNECT_GRACE:
+            object_tracker.resume(outage)
+        else:
+            object_tracker.clear()
 
-def _process_metadata(data):
+def _process_rtp_packet(packet):
+    if capture_writer is not None:
+        capture_writer.write(packet)
+    sequence_number, timestamp, marker, ssrc, payload_start, payload_end = parse_rtp_header(packet)
+    pipeline_metrics.packet_arrived(timestamp)
+    with memoryview(packet)[payload_start:payload_end] as payload_body:
+        if (STREAMING_PARSE or ZERO_COPY_RTP) and not STAGED_PIPELINE:
+            flags = frame_reassembler.check(sequence_number, timestamp, marker, len(payload_body), ssrc)
+            if flags & FRAGMENT_RESET:
+                metadata_parser.reset()
+            if flags & FRAGMENT_FEED:
+                _process_metadata_fragment(payload_body)
+        else:
+            frame = frame_reassembler.push(sequence_number, timestamp, marker, payload_body, ssrc)
+            if frame is not None:
+                arrival_ns = pipeline_metrics.frame_completed()
+                if frame_prefilter is not None and not frame_prefilter.wants(frame):
+                    return  # Nothing in this frame can change the tracker or the output
+                if process_worker is not None:
+                    process_worker.queue.put((frame, arrival_ns))
+                else:
+                    _process_metadata(frame, arrival_ns)
+
+def _process_metadata_fragment(fragment):
     try:
-        # Tracking Notification Topics 
-        entering_topic = "tns1:IVA/EnteringField/Entering_field"
-        leaving_topic = "tns1:IVA/LeavingField/Leaving_field"
-        infield_topc = "tns1:IVA/ObjectInField/Object_in_Field_1"
+        started_ns = time.perf_counter_ns()
+        frame = metadata_parser.feed(fragment, _process_notification)
+        pipeline_metrics.fragment_parsed(started_ns)
+        if frame is not None:
+            arrival_ns = pipeline_metrics.fragments_completed()
+            utc_time, objects_by_id = frame
+            started_ns = time.perf_counter_ns()
+            data_by_object_id = _select_tracked_objects(objects_by_id)
+            pipeline_metrics.lap(pipeline_metrics.extract, started_ns)
+            pipeline_metrics.frame_processed(arrival_ns, len(objects_by_id), len(data_by_object_id))
 
-        data_by_object_id = {}
-        
-        root = ET.fromstring(data)
-        
-        for notification_message in root.findall('.//wsnt:NotificationMessage', namespaces={'wsnt': 'http://docs.oasis-open.org/wsn/b-2'}):
-            topic = notification_message.find('./wsnt:Topic', namespaces={'wsnt': 'http://docs.oasis-open.org/wsn/b-2'}).text
+            _send_data_to_client(data_by_object_id)
+    except ET.ParseError as parse_error:
+        pipeline_metrics.parse_errors.inc()
+        print(f"Error parsing XML data: {parse_error}", flush=True)
+    except Exception as e:
+        print(f"An unexpected error occurred in _process_metadata_fragment: {e}", flush=True)
 
-            if topic == entering_topic:
-                _process_entering_object(notification_message)
+def _process_notification(notification_message):
+    _apply_notification(notification_topic(notification_message), notification_object_ids(notification_message))
 
-            elif topic == leaving_topic:
-                _process_leaving_object(notification_message)
+def _apply_notification(topic, object_ids):
 
-        if len(object_info_tracking_stack) > 0:
-            for target_object_id in object_info_tracking_stack:
-                object_data = _extract_object_data(root, target_object_id)
+    if topic == entering_topic:
+        _process_entering_object(object_ids)
 
-                if object_data:
-                    data_by_object_id[target_object_id] = object_data
+    elif topic == leaving_topic:
+        _process_leaving_object(object_ids)
+
+def _process_metadata(data, arrival_ns=None):
+    try:
+        started_ns = time.perf_counter_ns()
+        notifications, objects_by_id = metadata_backend.parse(data)
+        with tracker_lock:
+            for topic, object_ids in notifications:
+                _apply_notification(topic, object_ids)
+            parsed_ns = pipeline_metrics.lap(pipeline_metrics.parse, started_ns)
+            data_by_object_id = _select_tracked_objects(objects_by_id)
+        pipeline_metrics.lap(pipeline_metrics.extract, parsed_ns)
+        pipeline_metrics.frame_processed(arrival_ns, len(objects_by_id), len(data_by_object_id))
 
         _send_data_to_client(data_by_object_id)
     
     except ET.ParseError as parse_error:
+        pipeline_metrics.parse_errors.inc()
         print(f"Error parsing XML data: {parse_error}", flush=True)
     except KeyError as key_error:
         print(f"KeyError: {key_error}", flush=True)
     except Exception as e:
         print(f"An unexpected error occurred in _process_metadata: {e}", flush=True)
 
-def _process_entering_object(notification_message):
-    try:
-        entering_object_keys = notification_message.find(".//tt:Message/tt:Key", namespaces={"tt": "http://www.onvif.org/ver10/schema"})
-        for key_element in entering_object_keys:
-            value = key_element.get("Value")
-            object_tracking_buffer.append(value)
-            if value not in object_info_tracking_stack:
-                object_info_tracking_stack[value] = {"initial_heading_x": None, "initial_heading_y": None}
-    except Exception as e:
-        print(f"An error occurred in _process_entering_object: {e}", flush=True)
+def _process_entering_object(object_ids):
+    for object_id in object_ids:
+        object_tracker.add(object_id)
 
-def _process_leaving_object(notification_message):
-    try:
-        exiting_object_keys = notification_message.find(".//tt:Message/tt:Key", namespaces={"tt": "http://www.onvif.org/ver10/schema"})
-        if exiting_object_keys:
-            for key_element in exiting_object_keys:
-                value = key_element.get("Value")
-                object_tracking_buffer.remove(value)
-                object_info_tracking_stack.pop(value)
-    except Exception as e:
-        print(f"An error occurred in _process_leaving_object: {e}", flush=True)
+def _process_leaving_object(object_ids):
+    for object_id in object_ids:
+        object_tracker.remove(object_id)
 
-def _extract_object_data(root, target_object_id):
-    try:
-        object_data = {}
-        
-        for object_elem in root.findall(".//tt:Object", namespaces={"tt": "http://www.onvif.org/ver10/schema"}):
-            if object_elem.get("ObjectId") == target_object_id:
-                utc_time = root.find(".//tt:Frame", namespaces={"tt": "http://www.onvif.org/ver10/schema"}).get('UtcTime')
-                if utc_time:
-                    object_data["utc_time"] = utc_time[:-1]
-                
-                center_of_gravity_elem = object_elem.find(".//tt:CenterOfGravity", namespaces={"tt": "http://www.onvif.org/ver10/schema"})
-                if center_of_gravity_elem is not None:
-                    object_data["x"] = center_of_gravity_elem.get("x")
-                    object_data["y"] = center_of_gravity_elem.get("y")
-                    
-                    if object_info_tracking_stack[target_object_id]["initial_heading_x"] is None:
-                        object_info_tracking_stack[target_object_id]["initial_heading_x"] = center_of_gravity_elem.get("x")
-                    if object_info_tracking_stack[target_object_id]["initial_heading_y"] is None:
-                        object_info_tracking_stack[target_object_id]["initial_heading_y"] = center_of_gravity_elem.get("y")
-                    
-                    object_data["Heading"] = math.degrees(math.atan2(
-                        float(center_of_gravity_elem.get("y")) - float(object_info_tracking_stack[target_object_id]["initial_heading_y"]),
-                        float(center_of_gravity_elem.get("x")) - float(object_info_tracking_stack[target_object_id]["initial_heading_y"])))
-                    #Update initial_heading values to current value to calculate the next heading
-                    object_info_tracking_stack[target_object_id]["initial_heading_x"] = center_of_gravity_elem.get("x")
-                    object_info_tracking_stack[target_object_id]["initial_heading_y"] = center_of_gravity_elem.get("y")
-                
-                class_candidate_elem = object_elem.find(".//tt:ClassCandidate", namespaces={"tt": "http://www.onvif.org/ver10/schema"})
-                if class_candidate_elem is not None:
-                    object_data["class_candidate_type"] = class_candidate_elem.find(".//tt:Type", namespaces={"tt": "http://www.onvif.org/ver10/schema"}).text
-                    object_data["likelihood"] = class_candidate_elem.find(".//tt:Likelihood", namespaces={"tt": "http://www.onvif.org/ver10/schema"}).text
-                
-                
-                geolocation_elem = object_elem.find(".//tt:GeoLocation", namespaces={"tt": "http://www.onvif.org/ver10/schema"})
-                if geolocation_elem is not None:
-                    object_data["lat"] = geolocation_elem.get("lat")
-                    object_data["lon"] = geolocation_elem.get("lon")
-                    object_data["elevation"] = geolocation_elem.get("elevation")
-
-                speed_elem = object_elem.find(".//tt:Speed", namespaces={"tt": "http://www.onvif.org/ver10/schema"})
-                if speed_elem is not None:
-                    object_data["Speed"] = speed_elem.text
-
-                break
-    except Exception as e:
-        print(f"An error occurred in _extract_object_data: {e}", flush=True)
+def _select_tracked_objects(objects_by_id):
+    # Tracked objects are looked up in the per-frame index instead of rescanning the document
+    now = time.monotonic()
+    data_by_object_id = {}
+    moving_objects = []
+    for target_object_id, tracked in object_tracker.items():
+        object_data = objects_by_id.get(target_object_id)
+        if object_data:
+            tracked.last_seen = now
+            tracked.utc_time = object_data.get("utc_time")
+            tracked.class_candidate_type = object_data.get("class_candidate_type")
+            if "x" in object_data:
+                moving_objects.append((tracked, object_data))
+            data_by_object_id[target_object_id] = object_data
+    if moving_objects:
+        _update_headings(moving_objects)
+    object_tracker.expire(now)
+    return data_by_object_id
 
-    return object_data
+def _update_headings(moving_objects):
+    # Heading of every object in the frame from its previous centre of gravity, computed in one batch
+    current_x = [float(object_data["x"]) for _, object_data in moving_objects]
+    current_y = [float(object_data["y"]) for _, object_data in moving_objects]
+    previous_x = [x if tracked.x is None else tracked.x for (tracked, _), x in zip(moving_objects, current_x)]
+    previous_y = [y if tracked.y is None else tracked.y for (tracked, _), y in zip(moving_objects, current_y)]
+    headings = position_headings(current_x, current_y, previous_x, previous_y)
+    for (tracked, object_data), x, y, heading in zip(moving_objects, current_x, current_y, headings):
+        object_data["Heading"] = heading
+        #Update the previous position to the current value to calculate the next heading
+        tracked.x = x
+        tracked.y = y
 
 def _send_data_to_client(data_by_object_id):
     # current_time = time.time()
@@ -159,65 +232,88 @@ def _send_data_to_client(data_by_object_id):
 
     # if current_time - _send_data_to_client.last_send_time >=0.1:
     try:
-        # Constants for packing data
-        DATA_FORMAT = "IIQiiiiii"
-        HEADER_FORMAT = "Ii"
-        # Define the number of objects
-        NUM_OBJECTS = len(data_by_object_id)
-        # Create a header for the object data list
-        ObjectDataList = struct.pack(HEADER_FORMAT, 0xdeadbeef, NUM_OBJECTS)
-
-        # Pack and send data for each object
-        packed_data = b""
+        started_ns = time.perf_counter_ns()
+        # Collect the Human objects column by column, unit conversion and packing run over the whole batch
+        object_ids, times_ms, latitudes, longitudes, elevations, speeds, headings = [], [], [], [], [], [], []
         for object_id, value in data_by_object_id.items():
             if value.get("utc_time") and value.get("class_candidate_type") == "Human":
-                # Extract data for packing
-                object_type = 2  
-                time_str = value.get("utc_time")
-                time_dt = datetime.fromisoformat(time_str)  # Assuming time is in ISO format
-                time_ms = int(time_dt.timestamp() * 1000)  # Convert to milliseconds
-                current_latitude_micro_deg = int(float(value.get("lat")) * 1e7)  # Convert latitude to micro-degrees
-                current_longitude_micro_deg = int(float(value.get("lon")) * 1e7)  # Convert longitude to micro-degrees
-                elevation =  int(float(value.get("elevation")) / 10)  # Convert elevation to units of 10cm steps
-                speed = int(float(value.get("Speed")) * 50)  # Convert speed to units of 0.02 m/s
-                heading = int(float(value.get("Heading")) / 0.0125)  # Convert heading to units of 0.0125 degrees
-                pad_value = 0    # pad value
-
-                # Pack the data for the current object
-                packed_data += struct.pack(DATA_FORMAT, object_id, object_type, time_ms,
-                                        current_latitude_micro_deg, current_longitude_micro_deg,
-                                        elevation, speed, heading, pad_value)
-        # Combine header and packed data
-        Msg = ObjectDataList + packed_data
+                if not value.get("lat") or not value.get("lon"):
+                    continue  # No GeoLocation, an SDSM record needs a position
+                times_ms.append(utc_time_codec.to_epoch_ms(value.get("utc_time")))  # Convert to milliseconds
+                object_ids.append(int(object_id))
+                latitudes.append(value.get("lat"))
+                longitudes.append(value.get("lon"))
+                elevations.append(value.get("elevation") or 0)  # Missing elevation, speed and heading are sent as 0
+                speeds.append(value.get("Speed") or 0)
+                headings.append(value.get("Heading") or 0)
+        capture_time_ms = max(times_ms, default=0)  # Newest frame UtcTime in this message
+        headings = heading_units(headings)
+        if change_filter is not None:
+            object_ids, times_ms, latitudes, longitudes, elevations, speeds, headings = change_filter.apply(
+                object_ids, times_ms, latitudes, longitudes, elevations, speeds, headings)
+            if not object_ids:
+                pipeline_metrics.discard_pending()
+                return  # Nothing changed since the last message
 
+        # Pack data for all objects into the reusable datagram buffer
+        sdsm_encoder.reset()
+        sdsm_encoder.add_objects(object_ids, OBJECT_TYPE_HUMAN, times_ms, latitudes, longitudes,
+                                 elevations, speeds, headings)
+        # Header carries the number of records actually packed
+        Msg = sdsm_encoder.finish()
+        packed_ns = pipeline_metrics.lap(pipeline_metrics.pack, started_ns)
+
+        # Local consumers read the same bytes from shared memory, see shm_ring.py
+        if shm_ring is not None:
+            shm_ring.write(Msg)
         # Send the data over UDP
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.sendto(Msg, (UDP_IP, UDP_PORT))
-        print(f"Message : {Msg}", flush=True)
+        udp_sender.send(Msg)
+        pipeline_metrics.lap(pipeline_metrics.send, packed_ns)
+        pipeline_metrics.published(len(Msg), capture_time_ms)
+        print(f"Message : {Msg.tobytes()}", flush=True)
     except Exception as e:
         print(f"An error occurred in _send_data_to_client: {e}", flush=True)
 
 if __name__ == "__main__":
     try:
-        rtsp_url = os.getenv("RTSP_URL")
-        pipeline_str = f"rtspsrc location={rtsp_url} ! application/x-rtp, media=application, payload=107, encoding-name=VND.ONVIF.METADATA! rtpjitterbuffer ! appsink name=appsink"
-        pipeline = Gst.parse_launch(pipeline_str)
-
-        # Connect to the EOS (end-of-stream) signal
-        bus = pipeline.get_bus()
+        if METRICS_PORT:
+            start_metrics_server(metrics_registry, METRICS_HOST, METRICS_PORT)
 
-        pipeline.set_state(Gst.State.PLAYING)
+        if STAGED_PIPELINE:
+            process_worker = StageWorker("process", FrameQueue(FRAME_QUEUE_SIZE, FRAME_QUEUE_POLICY),
+                                         lambda item: _process_metadata(*item))
+            process_worker.start()
+            metrics_registry.add_stats("rtsp_metadata_frame_queue", process_worker.stats)
 
-        # Retrieve the appsink element from the pipeline
-        appsink = pipeline.get_by_name("appsink")
-        appsink.set_property("emit-signals", True)
+        if REPLAY_RTP:
+            # Offline run through the same processing path, no camera needed
+            packets = replay(REPLAY_RTP, _process_rtp_packet, realtime=REPLAY_REALTIME)
+            print(f"Replayed {packets} packets from {REPLAY_RTP}", flush=True)
+        else:
+            if RECORD_RTP:
+                capture_writer = CaptureWriter(RECORD_RTP)
 
-        # Connect the new-sample signal to a callback function
-        appsink.connect("new-sample", on_new_sample)
+            rtsp_url = os.getenv("RTSP_URL")
+            # The supervisor wires the appsink (pulled in batches or through new-sample) and rebuilds
+            # the pipeline whenever the bus reports an error or EOS or the packets stop
+            pipeline_supervisor = PipelineSupervisor(
+                lambda: build_pipeline(rtsp_url, JITTERBUFFER_LATENCY_MS, APPSINK_MAX_BUFFERS, APPSINK_DROP, APPSINK_SYNC),
+                _process_buffer, APPSINK_PULL, RECONNECT_DATA_TIMEOUT, RECONNECT_BACKOFF_MS / 1000, RECONNECT_BACKOFF_MAX_MS / 1000,
+                _on_stream_resumed, metrics_registry)
 
-        while True:
-            pass  # Infinite loop to keep the connection alive
+            # Block in the GLib main loop until Ctrl+C
+            pipeline_supervisor.run()
     except KeyboardInterrupt:
         print("Stopped")
     except Exception as e:
         print(f"An error occurred: {e}")
+    finally:
+        if pipeline_supervisor is not None:
+            pipeline_supervisor.stop()
+        if process_worker is not None:
+            process_worker.stop()
+        if capture_writer is not None:
+            capture_writer.close()
+        if shm_ring is not None:
+            shm_ring.close()
+        udp_sender.close()
@@ -1,173 +1,76 @@
 import os
 import json
-import xml.etree.ElementTree as ET
 import math
 import gi
 import socket
-import struct
+import threading
 import time
-import sched
 import datetime
+from udp_sender import UdpSender, parse_destinations
+from gst_runtime import PipelineSupervisor, build_pipeline
+from capture import CaptureWriter, replay
+from publisher import FixedRatePublisher
+from shm_ring import ShmRingWriter
+from metrics import MetricsRegistry, start_metrics_server
+from rtp import map_buffer
+from multi_source import SourceProcessor
 
 gi.require_version('Gst', '1.0')
-from gi.repository import Gst
+from gi.repository import GLib, Gst
 
 Gst.init(None)
-frame_sample_buffer = []  # Buffer to keep samples until the entire frame is available
-object_tracking_buffer = []
-object_info_tracking_stack = {}
 UDP_IP = '127.0.0.1'
 UDP_PORT = 3157
+UDP_DESTINATIONS = os.getenv("UDP_DESTINATIONS", f"{UDP_IP}:{UDP_PORT}")  # Comma separated host:port list
+udp_sender = UdpSender(parse_destinations(UDP_DESTINATIONS))  # Long-lived sockets reused for every message
+SHM_RING_PATH = os.getenv("SHM_RING_PATH")  # Also write every SDSM message to a shared-memory ring for local consumers, e.g. /dev/shm/sdsm_ring
+SHM_RING_SLOTS = int(os.getenv("SHM_RING_SLOTS", "64"))  # Messages kept in the ring
+shm_ring = ShmRingWriter(SHM_RING_PATH, SHM_RING_SLOTS) if SHM_RING_PATH else None
+ZERO_COPY_RTP = os.getenv("ZERO_COPY_RTP", "0") == "1"  # Map RTP buffers read-only and feed the incremental parser directly
+APPSINK_PULL = os.getenv("APPSINK_PULL", "0") == "1"  # Drain the appsink from a puller thread instead of a signal per packet
+JITTERBUFFER_LATENCY_MS = os.getenv("JITTERBUFFER_LATENCY_MS")  # rtspsrc/rtpjitterbuffer latency, unset keeps the GStreamer defaults
+APPSINK_MAX_BUFFERS = int(os.getenv("APPSINK_MAX_BUFFERS", "0"))  # Appsink queue limit in packets, 0 is unbounded
+APPSINK_DROP = os.getenv("APPSINK_DROP", "0") == "1"  # Drop the oldest packet when the appsink queue is full instead of blocking
+APPSINK_SYNC = os.getenv("APPSINK_SYNC", "1") == "1"  # Hold packets until their running time, 0 hands them over on arrival
+RECONNECT_DATA_TIMEOUT = float(os.getenv("RECONNECT_DATA_TIMEOUT", "5"))  # Seconds without RTP packets before the pipeline is rebuilt, 0 only reacts to bus errors
+RECONNECT_BACKOFF_MS = int(os.getenv("RECONNECT_BACKOFF_MS", "500"))  # First reconnect delay, doubled after every failed attempt
+RECONNECT_BACKOFF_MAX_MS = int(os.getenv("RECONNECT_BACKOFF_MAX_MS", "30000"))
+pipeline_supervisor = None  # Rebuilds the RTSP pipeline when the stream is lost
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # Prometheus text endpoint at /metrics, 0 disables it
+metrics_registry = MetricsRegistry()
+if shm_ring is not None:
+    metrics_registry.add_stats("rtsp_metadata_shm_ring", shm_ring.stats)
+metrics_registry.add_stats("rtsp_metadata_udp", udp_sender.stats)
+RECORD_RTP = os.getenv("RECORD_RTP")  # Capture file that every received RTP packet is appended to
+REPLAY_RTP = os.getenv("REPLAY_RTP")  # Capture file to process instead of the RTSP camera
+REPLAY_REALTIME = os.getenv("REPLAY_REALTIME", "1") == "1"  # Keep the recorded packet timing, otherwise as fast as possible
+capture_writer = None
+
+SEND_INTERVAL_MS = int(os.getenv("SEND_INTERVAL_MS", "100"))  # Publish period, 100ms gives V2X 10 Hz updates
+publisher = None  # Flushes source_processor on fixed monotonic deadlines
+
+def _send_message(message):
+    # Local consumers read the same bytes from shared memory, see shm_ring.py
+    if shm_ring is not None:
+        shm_ring.write(message)
+    # Send the data over UDP
+    udp_sender.send(message)
+
+# Reassembly, parsing, tracking and SDSM packing, the same code multi_source.py runs per source
+source_processor = SourceProcessor("rtsp", _send_message, metrics_registry)
+
+def _process_buffer(buffer):
+    if ZERO_COPY_RTP:
+        with map_buffer(buffer, Gst.MapFlags.READ) as packet:
+            _process_rtp_packet(packet)
+    else:
+        _process_rtp_packet(buffer.extract_dup(0, buffer.get_size()))
 
-scheduler = sched.scheduler(time.time, time.sleep)
-data_to_send = {}  # Data to be sent every 100ms
-
-def on_new_sample(appsink):
-    try:
-        sample = appsink.emit("pull-sample")
-        if sample:
-            buffer = sample.get_buffer()
-            payload_size = buffer.get_size()
-            payload_data = buffer.extract_dup(0, payload_size)
-
-            rtp_header = payload_data[:12]
-            timestamp = int.from_bytes(rtp_header[4:8], byteorder='big')
-            sequence_number = int.from_bytes(rtp_header[2:4], byteorder='big')
-            payload_body = payload_data[12:]
-            decoded_data = payload_body.decode('UTF-8')
-            
-            if _is_complete_metadata_frame(decoded_data):
-                frame_sample_buffer.append(decoded_data)
-                combined_metadata = "".join(frame_sample_buffer)
-                frame_sample_buffer.clear()
-                _process_metadata(combined_metadata)
-            else:
-                frame_sample_buffer.append(decoded_data)
-    except Exception as e:
-        print(f"An error occurred in on_new_sample: {e}", flush=True)
-    return Gst.FlowReturn.OK
-
-def _is_complete_metadata_frame(data):
-    return data.endswith("</tt:MetadataStream>")
-
-def _process_metadata(data):
-    try:
-        # Tracking Notification Topics 
-        entering_topic = "tns1:IVA/EnteringField/Entering_field"
-        leaving_topic = "tns1:IVA/LeavingField/Leaving_field"
-        infield_topc = "tns1:IVA/ObjectInField/Object_in_Field_1"
-
-        data_by_object_id = {}
-        
-        root = ET.fromstring(data)
-        # print(root,flush=True)
-        for notification_message in root.findall('.//wsnt:NotificationMessage', namespaces={'wsnt': 'http://docs.oasis-open.org/wsn/b-2'}):
-            topic = notification_message.find('./wsnt:Topic', namespaces={'wsnt': 'http://docs.oasis-open.org/wsn/b-2'}).text
-            print(topic,flush=True)
-            if topic == entering_topic:
-                _process_entering_object(notification_message)
-
-            elif topic == leaving_topic:
-                _process_leaving_object(notification_message)
-        # print("len(object_info_tracking_stack)",len(object_info_tracking_stack),flush=True)
-        if len(object_info_tracking_stack) > 0:
-            for target_object_id in object_info_tracking_stack:
-                object_data = _extract_object_data(root, target_object_id)
-
-                if object_data:
-                    data_by_object_id[target_object_id] = object_data
-        # print(data_by_object_id,flush=True)
-        data_to_send.update(data_by_object_id)
-    
-    except ET.ParseError as parse_error:
-        print(f"Error parsing XML data: {parse_error}", flush=True)
-    except KeyError as key_error:
-        print(f"KeyError: {key_error}", flush=True)
-    except Exception as e:
-        print(f"An unexpected error occurred in _process_metadata: {e}", flush=True)
-
-def _process_entering_object(notification_message):
-    # print("Entering",flush=True)
-    try:
-        entering_object_keys = notification_message.find(".//tt:Message/tt:Key", namespaces={"tt": "http://www.onvif.org/ver10/schema"})
-        for key_element in entering_object_keys:
-            value = key_element.get("Value")
-            object_tracking_buffer.append(value)
-            if value not in object_info_tracking_stack:
-                object_info_tracking_stack[value] = {"initial_heading_x": None, "initial_heading_y": None,"initial_heading_x1": None, "initial_heading_y1": None}
-    except Exception as e:
-        print(f"An error occurred in _process_entering_object: {e}", flush=True)
-
-def _process_leaving_object(notification_message):
-    # print("leaving",flush=True)
-    try:
-        exiting_object_keys = notification_message.find(".//tt:Message/tt:Key", namespaces={"tt": "http://www.onvif.org/ver10/schema"})
-        if exiting_object_keys:
-            for key_element in exiting_object_keys:
-                value = key_element.get("Value")
-                object_tracking_buffer.remove(value)
-                object_info_tracking_stack.pop(value)
-    except Exception as e:
-        print(f"An error occurred in _process_leaving_object: {e}", flush=True)
-
-def _extract_object_data(root, target_object_id):
-    # print("Inside extract data ",flush=True)
-    try:
-        object_data = {}
-        
-        for object_elem in root.findall(".//tt:Object", namespaces={"tt": "http://www.onvif.org/ver10/schema"}):
-            if object_elem.get("ObjectId") == target_object_id:
-                utc_time = root.find(".//tt:Frame", namespaces={"tt": "http://www.onvif.org/ver10/schema"}).get('UtcTime')
-                if utc_time:
-                    object_data["utc_time"] = utc_time[:-1]
-                
-                center_of_gravity_elem = object_elem.find(".//tt:CenterOfGravity", namespaces={"tt": "http://www.onvif.org/ver10/schema"})
-                if center_of_gravity_elem is not None:
-                    object_data["x"] = center_of_gravity_elem.get("x")
-                    object_data["y"] = center_of_gravity_elem.get("y")
-                    # object_data["Heading"] = _calculate_heading_position(object_data["x"],object_data["y"],object_info_tracking_stack[target_object_id]["initial_heading_x"],object_info_tracking_stack[target_object_id]["initial_heading_y"])
-                    
-                    # if object_info_tracking_stack[target_object_id]["initial_heading_x"] is None:
-                    #     object_info_tracking_stack[target_object_id]["initial_heading_x"] = center_of_gravity_elem.get("x")
-                    # if object_info_tracking_stack[target_object_id]["initial_heading_y"] is None:
-                    #     object_info_tracking_stack[target_object_id]["initial_heading_y"] = center_of_gravity_elem.get("y")
-                    
-                    # object_data["Heading"] = math.degrees(math.atan2(
-                    #     float(center_of_gravity_elem.get("y")) - float(object_info_tracking_stack[target_object_id]["initial_heading_y"]),
-                    #     float(center_of_gravity_elem.get("x")) - float(object_info_tracking_stack[target_object_id]["initial_heading_x"])))
-                    #Update initial_heading values to current value to calculate the next heading
-                    # object_info_tracking_stack[target_object_id]["initial_heading_x"] = center_of_gravity_elem.get("x")
-                    # object_info_tracking_stack[target_object_id]["initial_heading_y"] = center_of_gravity_elem.get("y")
-                    # print(object_data["Heading"],flush=True)
-                class_candidate_elem = object_elem.find(".//tt:ClassCandidate", namespaces={"tt": "http://www.onvif.org/ver10/schema"})
-                if class_candidate_elem is not None:
-                    object_data["class_candidate_type"] = class_candidate_elem.find(".//tt:Type", namespaces={"tt": "http://www.onvif.org/ver10/schema"}).text
-                    object_data["likelihood"] = class_candidate_elem.find(".//tt:Likelihood", namespaces={"tt": "http://www.onvif.org/ver10/schema"}).text
-                
-                
-                geolocation_elem = object_elem.find(".//tt:GeoLocation", namespaces={"tt": "http://www.onvif.org/ver10/schema"})
-                if geolocation_elem is not None:
-                    object_data["lat"] = geolocation_elem.get("lat")
-                    object_data["lon"] = geolocation_elem.get("lon")
-                    object_data["elevation"] = geolocation_elem.get("elevation")
-                    if object_info_tracking_stack[target_object_id]["initial_heading_x1"] is None:
-                        object_info_tracking_stack[target_object_id]["initial_heading_x1"] = object_data["lat"]
-                    if object_info_tracking_stack[target_object_id]["initial_heading_y1"] is None:
-                        object_info_tracking_stack[target_object_id]["initial_heading_y1"] = object_data["lon"]
-                    
-                    # object_data["Heading"]=calculate_bearing(object_info_tracking_stack[target_object_id]["initial_heading_x1"],object_info_tracking_stack[target_object_id]["initial_heading_y1"],object_data["lat"],object_data["lon"])
-                    # object_info_tracking_stack[target_object_id]["initial_heading_x1"] = geolocation_elem.get("lat")
-                    # object_info_tracking_stack[target_object_id]["initial_heading_y1"] = geolocation_elem.get("lon")
-                    # print(object_data["Heading"],flush=True)
-                speed_elem = object_elem.find(".//tt:Speed", namespaces={"tt": "http://www.onvif.org/ver10/schema"})
-                if speed_elem is not None:
-                    object_data["Speed"] = speed_elem.text
-
-                break
-    except Exception as e:
-        print(f"An error occurred in _extract_object_data: {e}", flush=True)
-
-    return object_data
+def _process_rtp_packet(packet):
+    if capture_writer is not None:
+        capture_writer.write(packet)
+    source_processor.handle_packet(packet)
 
 def _calculate_heading(heading_data):
     print(int(float(heading_data) / 0.0125),flush=True)
@@ -181,118 +84,55 @@ def _calculate_heading_position(current_x,current_y,previous_x,previous_y):
         return abs(int(math.degrees(math.atan2(float(current_y) - float(previous_y),float(current_x) - float(previous_x)))/0.0125))
 
 
-import math
-
-def calculate_bearing(lat1, lon1, lat2, lon2):
+def _replay_capture(loop):
     try:
-        
-        # Convert degrees to radians
-        lat1 = math.radians(float(lat1))
-        lon1 = math.radians(float(lon1))
-        lat2 = math.radians(float(lat2))
-        lon2 = math.radians(float(lon2))
-        
-        # Calculate differences
-        delta_lon = lon2 - lon1
-        
-        # Calculate bearing
-        x = math.sin(delta_lon) * math.cos(lat2)
-        y = math.cos(lat1) * math.sin(lat2) - (math.sin(lat1) * math.cos(lat2) * math.cos(delta_lon))
-        initial_bearing = math.atan2(x, y)
-        
-        # Convert radians to degrees
-        initial_bearing = math.degrees(initial_bearing)
-        
-        # Normalize bearing to 0-360/0.0125
-        compass_bearing = ((initial_bearing + 360) % 360) / 0.0125
-        
-        return abs(int(compass_bearing))
-
+        packets = replay(REPLAY_RTP, _process_rtp_packet, realtime=REPLAY_REALTIME)
+        print(f"Replayed {packets} packets from {REPLAY_RTP}", flush=True)
     except Exception as e:
-        print("An error occurred:", str(e), flush=True)
-        return None
-
-
-def _send_data_to_client(data_by_object_id):
-    # current_time = time.time()
-    # if not hasattr(_send_data_to_client,'last_send_time'):
-    #     _send_data_to_client.last_send_time = current_time
-
-    # if current_time - _send_data_to_client.last_send_time >=0.1:
-    try:
-        # Constants for packing data
-        DATA_FORMAT = "IIQiiiiii"
-        HEADER_FORMAT = "Ii"
-        # Define the number of objects
-        NUM_OBJECTS = len(data_by_object_id)
-        # Create a header for the object data list
-        ObjectDataList = struct.pack(HEADER_FORMAT, 0xdeadbeef, NUM_OBJECTS)
-
-        # Pack and send data for each object
-        packed_data = b""
-        for object_id, value in data_by_object_id.items():
-            if value.get("utc_time") and value.get("class_candidate_type") == "Human":
-                # Extract data for packing
-                object_type = 2  
-                time_str = value.get("utc_time")
-                time_dt = time.strptime(time_str, "%Y-%m-%dT%H:%M:%S.%f")  # Assuming time is in ISO format
-                time_ms = int(time.mktime(time_dt) * 1000) #Convert to ms
-                current_latitude_micro_deg = int(float(value.get("lat")) * 1e7)  # Convert latitude to micro-degrees
-                current_longitude_micro_deg = int(float(value.get("lon")) * 1e7)  # Convert longitude to micro-degrees
-                elevation =  int(float(value.get("elevation")) / 10)  # Convert elevation to units of 10cm steps
-                speed = int(float(value.get("Speed")) * 50)  # Convert speed to units of 0.02 m/s
-                # heading = (value.get("Heading"))  # Convert heading to units of 0.0125 degrees
-                # Calculate heading here
-                initial_lat = object_info_tracking_stack[object_id]["initial_heading_x1"]
-                initial_lon = object_info_tracking_stack[object_id]["initial_heading_y1"]
-                current_lat = value.get("lat")
-                current_lon = value.get("lon")
-                heading = calculate_bearing(initial_lat, initial_lon, current_lat, current_lon)
-                print(heading,flush=True)
-                # Update initial positions
-                object_info_tracking_stack[object_id]["initial_heading_x1"] = current_lat
-                object_info_tracking_stack[object_id]["initial_heading_y1"] = current_lon
-
-                pad_value = 0    # pad value
-                # Pack the data for the current object
-                packed_data += struct.pack(DATA_FORMAT, int(object_id), object_type, time_ms,
-                                        current_latitude_micro_deg, current_longitude_micro_deg,
-                                        elevation, speed, heading, pad_value)
-        # Combine header and packed data
-        Msg = ObjectDataList + packed_data
-        # Send the data over UDP
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.sendto(Msg, (UDP_IP, UDP_PORT))
-        # print(f"Message : {Msg} {time.time()}", flush=True)
-    except Exception as e:
-        print(f"An error occurred in _send_data_to_client: {e}", flush=True)
-
-def schedule_send_data():
-    scheduler.enter(0, 1, send_data_periodically, (scheduler,))
-    scheduler.run()
-
-def send_data_periodically(sc):
-    global data_to_send
-    if data_to_send:
-        _send_data_to_client(data_to_send)
-        data_to_send = {}  # Clear the data after sending
-    scheduler.enter(0.2, 1, send_data_periodically, (sc,))  # Schedule next send after 100ms
+        print(f"An error occurred while replaying {REPLAY_RTP}: {e}", flush=True)
+    # Give the periodic send one more interval to flush what the last frames produced
+    GLib.timeout_add(SEND_INTERVAL_MS * 2, loop.quit)
 
 if __name__ == "__main__":
     try:
-        rtsp_url = os.getenv("RTSP_URL")
-        pipeline_str = f"rtspsrc location={rtsp_url} ! application/x-rtp, media=application, payload=107, encoding-name=VND.ONVIF.METADATA! rtpjitterbuffer ! appsink name=appsink"
-        pipeline = Gst.parse_launch(pipeline_str)
-
-        appsink = pipeline.get_by_name("appsink")
-        appsink.set_property("emit-signals", True)
-        appsink.connect("new-sample", on_new_sample)
-
-        pipeline.set_state(Gst.State.PLAYING)
-
-        schedule_send_data()
+        if METRICS_PORT:
+            start_metrics_server(metrics_registry, METRICS_HOST, METRICS_PORT)
+
+        source_processor.start()
+
+        # Periodic send runs on its own thread, the GLib main loop only services the pipeline bus
+        publisher = FixedRatePublisher(SEND_INTERVAL_MS / 1000, source_processor.flush)
+        publisher.start()
+        metrics_registry.add_stats("rtsp_metadata_publisher", publisher.stats)
+
+        if REPLAY_RTP:
+            # Offline run through the same processing path, no camera needed
+            loop = GLib.MainLoop()
+            threading.Thread(target=_replay_capture, args=(loop,), name="replay", daemon=True).start()
+            loop.run()
+        else:
+            if RECORD_RTP:
+                capture_writer = CaptureWriter(RECORD_RTP)
+
+            rtsp_url = os.getenv("RTSP_URL")
+            pipeline_supervisor = PipelineSupervisor(
+                lambda: build_pipeline(rtsp_url, JITTERBUFFER_LATENCY_MS, APPSINK_MAX_BUFFERS, APPSINK_DROP, APPSINK_SYNC),
+                _process_buffer, APPSINK_PULL, RECONNECT_DATA_TIMEOUT, RECONNECT_BACKOFF_MS / 1000, RECONNECT_BACKOFF_MAX_MS / 1000,
+                source_processor.resume, metrics_registry)
+            pipeline_supervisor.run()
 
     except KeyboardInterrupt:
         print("Application stopped by user", flush=True)
     except Exception as e:
         print(f"An error occurred: {e}", flush=True)
+    finally:
+        if publisher is not None:
+            publisher.stop()
+        if pipeline_supervisor is not None:
+            pipeline_supervisor.stop()
+        source_processor.stop()
+        if capture_writer is not None:
+            capture_writer.close()
+        if shm_ring is not None:
+            shm_ring.close()
+        udp_sender.close()
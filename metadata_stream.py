@@ -0,0 +1,145 @@
+import xml.etree.ElementTree as ET
+
+TT_NAMESPACE = "http://www.onvif.org/ver10/schema"
+WSNT_NAMESPACE = "http://docs.oasis-open.org/wsn/b-2"
+NAMESPACES = {"tt": TT_NAMESPACE, "wsnt": WSNT_NAMESPACE}
+
+METADATA_STREAM_TAG = f"{{{TT_NAMESPACE}}}MetadataStream"
+FRAME_TAG = f"{{{TT_NAMESPACE}}}Frame"
+OBJECT_TAG = f"{{{TT_NAMESPACE}}}Object"
+NOTIFICATION_MESSAGE_TAG = f"{{{WSNT_NAMESPACE}}}NotificationMessage"
+
+
+def extract_object_data(object_elem, utc_time):
+    # Pull the fields we publish out of a single tt:Object element
+    object_data = {}
+    if utc_time:
+        object_data["utc_time"] = utc_time  # Raw, UtcTimeCodec reads the Z or the offset
+
+    center_of_gravity_elem = object_elem.find(".//tt:CenterOfGravity", namespaces=NAMESPACES)
+    if center_of_gravity_elem is not None:
+        object_data["x"] = center_of_gravity_elem.get("x")
+        object_data["y"] = center_of_gravity_elem.get("y")
+
+    class_candidate_elem = object_elem.find(".//tt:ClassCandidate", namespaces=NAMESPACES)
+    if class_candidate_elem is not None:
+        object_data["class_candidate_type"] = class_candidate_elem.find(".//tt:Type", namespaces=NAMESPACES).text
+        object_data["likelihood"] = class_candidate_elem.find(".//tt:Likelihood", namespaces=NAMESPACES).text
+
+    geolocation_elem = object_elem.find(".//tt:GeoLocation", namespaces=NAMESPACES)
+    if geolocation_elem is not None:
+        object_data["lat"] = geolocation_elem.get("lat")
+        object_data["lon"] = geolocation_elem.get("lon")
+        object_data["elevation"] = geolocation_elem.get("elevation")
+
+    speed_elem = object_elem.find(".//tt:Speed", namespaces=NAMESPACES)
+    if speed_elem is not None:
+        object_data["Speed"] = speed_elem.text
+
+    return object_data
+
+
+class MetadataStreamParser:
+    # Incremental parser for tt:MetadataStream documents that arrive split over RTP packets.
+    # Notifications are handed to the caller as soon as they close and objects are reduced to
+    # their extracted fields, after which both elements are dropped from the partial tree.
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # Throw away any partially parsed frame and start a fresh document
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._open_elements = []
+        self._utc_time = None
+        self._objects = {}
+
+    def feed(self, fragment, on_notification):
+        # Returns (utc_time, objects_by_id) once </tt:MetadataStream> has been parsed, otherwise None
+        try:
+            self._parser.feed(fragment)
+            for event, elem in self._parser.read_events():
+                if event == "start":
+                    if elem.tag == FRAME_TAG and self._utc_time is None:
+                        self._utc_time = elem.get("UtcTime")
+                    self._open_elements.append(elem)
+                    continue
+
+                self._open_elements.pop()
+                if elem.tag == OBJECT_TAG:
+                    object_id = elem.get("ObjectId")
+                    if object_id not in self._objects:
+                        self._objects[object_id] = extract_object_data(elem, self._utc_time)
+                    self._release(elem)
+                elif elem.tag == NOTIFICATION_MESSAGE_TAG:
+                    on_notification(elem)
+                    self._release(elem)
+                elif elem.tag == METADATA_STREAM_TAG:
+                    frame = (self._utc_time, self._objects)
+                    self.reset()
+                    return frame
+        except ET.ParseError:
+            self.reset()
+            raise
+        return None
+
+    def _release(self, elem):
+        elem.clear()
+        if self._open_elements:
+            self._open_elements[-1].remove(elem)
+
+
+def index_objects(root):
+    # Single pass over a parsed MetadataStream: ObjectId -> extracted fields
+    frame_elem = root.find(".//tt:Frame", namespaces=NAMESPACES)
+    utc_time = frame_elem.get("UtcTime") if frame_elem is not None else None
+
+    objects_by_id = {}
+    for object_elem in root.iter(OBJECT_TAG):
+        object_id = object_elem.get("ObjectId")
+        if object_id not in objects_by_id:
+            objects_by_id[object_id] = extract_object_data(object_elem, utc_time)
+    return objects_by_id
+
+
+def notification_topic(notification_message):
+    return notification_message.find("./wsnt:Topic", namespaces=NAMESPACES).text
+
+
+def notification_object_ids(notification_message):
+    # ObjectId values listed under tt:Message/tt:Key of an Entering/Leaving notification
+    key_elem = notification_message.find(".//tt:Message/tt:Key", namespaces=NAMESPACES)
+    if key_elem is None:
+        return []
+    return [item_elem.get("Value") for item_elem in key_elem]
+
+
+class FramePrefilter:
+    # Substring checks on the raw bytes of a reassembled frame, run before any XML parsing. A frame
+    # without notifications that names none of the published classes can neither change the tracked
+    # set nor produce output, so it is skipped.
+
+    def __init__(self, class_names):
+        self.class_names = frozenset()
+        self.markers = []
+        self.set_classes(class_names)
+        self.passed_frames = 0
+        self.skipped_frames = 0
+
+    def set_classes(self, class_names):
+        # Safe to call while wants() runs on another thread, the marker list is swapped in one assignment
+        class_names = frozenset(class_names)
+        if class_names != self.class_names:
+            self.class_names = class_names
+            self.markers = [b"NotificationMessage"] + [class_name.encode() for class_name in sorted(class_names)]
+
+    def wants(self, frame):
+        for marker in self.markers:
+            if marker in frame:
+                self.passed_frames += 1
+                return True
+        self.skipped_frames += 1
+        return False
+
+    def stats(self):
+        return {"passed_frames": self.passed_frames, "skipped_frames": self.skipped_frames}
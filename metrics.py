@@ -0,0 +1,199 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Latency histograms, counters and a Prometheus text endpoint for the metadata pipeline
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+OUTAGE_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)  # Stream outages and reconnects
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter", f"{self.name} {self.value}"]
+
+
+class Histogram:
+    # Fixed buckets, observe() is a bisect and two additions under a lock
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def render(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {cumulative}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    # Holds counters and histograms, plus stats() callables of the pipeline components that are
+    # sampled when the endpoint is scraped
+
+    def __init__(self):
+        self._metrics = []
+        self._stats = []
+
+    def counter(self, name, help_text):
+        metric = Counter(name, help_text)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help_text, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_stats(self, prefix, stats, counters=()):
+        # Every numeric value of stats() is exported as <prefix>_<key>, typed counter for the keys in
+        # counters and untyped otherwise
+        self._stats.append((prefix, stats, frozenset(counters)))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, stats, counters in self._stats:
+            try:
+                values = stats()
+            except Exception as e:
+                print(f"An error occurred while collecting {prefix} stats: {e}", flush=True)
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)):
+                    lines.append(f"# TYPE {prefix}_{key} {'counter' if key in counters else 'untyped'}")
+                    lines.append(f"{prefix}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(registry, host, port):
+    # Serves registry.render() at /metrics from a daemon thread. Returns None when the port cannot be
+    # bound, e.g. by a second instance on a host network; the pipeline then runs without metrics.
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes every few seconds would flood the container log
+
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        print(f"Metrics disabled, could not listen on {host}:{port}: {e}", flush=True)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Metrics served at http://{host}:{server.server_port}/metrics", flush=True)
+    return server
+
+
+class PipelineMetrics:
+    # Per-frame timestamps from RTP arrival to the outgoing SDSM message. A frame is stamped when the
+    # first packet carrying its RTP timestamp arrives, every later stage is observed relative to that.
+
+    def __init__(self, registry):
+        self.packets = registry.counter("rtsp_metadata_packets_total", "RTP packets received from the appsink")
+        self.frames = registry.counter("rtsp_metadata_frames_total", "Complete MetadataStream frames")
+        self.objects = registry.counter("rtsp_metadata_objects_total", "tt:Object elements extracted from frames")
+        self.parse_errors = registry.counter("rtsp_metadata_parse_errors_total", "Frames that failed to parse")
+        self.messages = registry.counter("rtsp_metadata_messages_total", "SDSM messages sent")
+        self.message_bytes = registry.counter("rtsp_metadata_message_bytes_total", "SDSM bytes sent")
+        self.assembly = registry.histogram("rtsp_metadata_assembly_seconds", "First RTP packet of a frame to frame completion")
+        self.parse = registry.histogram("rtsp_metadata_parse_seconds", "XML parsing, field extraction and notification handling per frame")
+        self.extract = registry.histogram("rtsp_metadata_extract_seconds", "Tracked object selection and tracker update per frame")
+        self.pack = registry.histogram("rtsp_metadata_pack_seconds", "SDSM packing per message")
+        self.send = registry.histogram("rtsp_metadata_send_seconds", "Handing one SDSM message to the sockets")
+        self.ingest_to_send = registry.histogram("rtsp_metadata_ingest_to_send_seconds",
+                                                 "RTP arrival of the oldest frame in a message to the message being sent")
+        self.camera_to_send = registry.histogram("rtsp_metadata_camera_to_send_seconds",
+                                                 "Frame UtcTime to the message being sent, by the wall clock")
+        self.frame_arrival_ns = None
+        self._frame_timestamp = None
+        self._frame_parse_ns = 0
+        self._pending_since_ns = None
+
+    def packet_arrived(self, rtp_timestamp):
+        self.packets.inc()
+        if rtp_timestamp != self._frame_timestamp:
+            self._frame_timestamp = rtp_timestamp
+            self.frame_arrival_ns = time.perf_counter_ns()
+            self._frame_parse_ns = 0
+
+    def frame_completed(self):
+        # Returns the arrival time of the completed frame
+        self.frames.inc()
+        self.assembly.observe((time.perf_counter_ns() - self.frame_arrival_ns) / 1e9)
+        return self.frame_arrival_ns
+
+    def fragment_parsed(self, started_ns):
+        # The incremental parser works fragment by fragment, its cost is summed per frame
+        self._frame_parse_ns += time.perf_counter_ns() - started_ns
+
+    def fragments_completed(self):
+        self.parse.observe(self._frame_parse_ns / 1e9)
+        return self.frame_completed()
+
+    def lap(self, histogram, started_ns):
+        # Observes the time since started_ns and returns now, for chaining stages
+        now_ns = time.perf_counter_ns()
+        histogram.observe((now_ns - started_ns) / 1e9)
+        return now_ns
+
+    def frame_processed(self, arrival_ns, object_count, selected_count):
+        # Only frames that produced output start the ingest-to-send clock
+        self.objects.inc(object_count)
+        if selected_count and self._pending_since_ns is None and arrival_ns is not None:
+            self._pending_since_ns = arrival_ns
+
+    def discard_pending(self):
+        self._pending_since_ns = None
+
+    def published(self, message_size, capture_time_ms=None):
+        now_ns = time.perf_counter_ns()
+        self.messages.inc()
+        self.message_bytes.inc(message_size)
+        if self._pending_since_ns is not None:
+            self.ingest_to_send.observe((now_ns - self._pending_since_ns) / 1e9)
+            self._pending_since_ns = None
+        if capture_time_ms:
+            self.camera_to_send.observe(max(0.0, time.time() - capture_time_ms / 1000))
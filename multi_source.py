@@ -0,0 +1,383 @@
+import os
+import json
+import queue
+import threading
+import time
+import multiprocessing
+import xml.etree.ElementTree as ET
+from metadata_stream import FramePrefilter, MetadataStreamParser, notification_object_ids, notification_topic
+from parser_backends import create_backend
+from tracker import ObjectTracker
+from udp_sender import UdpSender, parse_destinations
+from shm_ring import ShmRingWriter
+from sdsm import OBJECT_TYPE_HUMAN, SdsmEncoder
+from geo import calculate_bearings
+from rtp import FRAGMENT_FEED, FRAGMENT_RESET, FrameReassembler, parse_rtp_header
+from stages import DROP_OLDEST, FrameQueue, StageWorker
+from utc_time import UtcTimeCodec
+from change_filter import ChangeFilter
+from metrics import MetricsRegistry, PipelineMetrics
+from publisher import FixedRatePublisher, LatestState
+
+# Runs many RTSP metadata sources in one container. Sources are sharded over worker processes,
+# every source keeps its own tracker state and all SDSM datagrams leave through one UdpSender
+# owned by the parent process. main3.py runs a single SourceProcessor for its one camera.
+
+UDP_DESTINATIONS = os.getenv("UDP_DESTINATIONS", "127.0.0.1:3157")  # Comma separated host:port list
+SEND_INTERVAL_MS = int(os.getenv("SEND_INTERVAL_MS", "100"))
+MAX_FRAME_SIZE = int(os.getenv("MAX_FRAME_SIZE", str(1024 * 1024)))  # Frames larger than this are dropped unparsed
+OUTPUT_QUEUE_SIZE = int(os.getenv("OUTPUT_QUEUE_SIZE", "1024"))
+TRACKER_TTL = float(os.getenv("TRACKER_TTL", "10"))  # Seconds unseen before an object whose LeavingField was lost is dropped
+MAX_TRACKED_OBJECTS = int(os.getenv("MAX_TRACKED_OBJECTS", "1024"))
+STREAMING_PARSE = os.getenv("STREAMING_PARSE", "0") == "1"  # Parse fragments incrementally as they arrive
+ZERO_COPY_RTP = os.getenv("ZERO_COPY_RTP", "0") == "1"  # Map RTP buffers read-only and feed the incremental parser directly
+STAGED_PIPELINE = os.getenv("STAGED_PIPELINE", "0") == "1"  # Hand reassembled frames to a worker thread instead of parsing on the streaming thread
+FRAME_QUEUE_SIZE = int(os.getenv("FRAME_QUEUE_SIZE", "8"))
+FRAME_QUEUE_POLICY = os.getenv("FRAME_QUEUE_POLICY", DROP_OLDEST)  # drop-oldest, drop-newest or latest
+FRAME_PREFILTER = os.getenv("FRAME_PREFILTER", "0") == "1"  # Skip frames without notifications or published classes unparsed
+PREFILTER_CLASSES = os.getenv("PREFILTER_CLASSES", "Human").split(",")
+PARSER_BACKEND = os.getenv("PARSER_BACKEND", "auto")  # etree, expat or lxml (when installed), auto takes expat
+DELTA_PUBLISHING = os.getenv("DELTA_PUBLISHING", "0") == "1"  # Resend an object only when it changed or its keepalive is due
+DELTA_POSITION_M = float(os.getenv("DELTA_POSITION_M", "0.2"))
+DELTA_SPEED_MPS = float(os.getenv("DELTA_SPEED_MPS", "0.1"))
+DELTA_HEADING_DEG = float(os.getenv("DELTA_HEADING_DEG", "5"))
+DELTA_KEEPALIVE_MS = int(os.getenv("DELTA_KEEPALIVE_MS", "1000"))
+APPSINK_PULL = os.getenv("APPSINK_PULL", "0") == "1"
+JITTERBUFFER_LATENCY_MS = os.getenv("JITTERBUFFER_LATENCY_MS")
+APPSINK_MAX_BUFFERS = int(os.getenv("APPSINK_MAX_BUFFERS", "0"))
+APPSINK_DROP = os.getenv("APPSINK_DROP", "0") == "1"
+APPSINK_SYNC = os.getenv("APPSINK_SYNC", "1") == "1"
+RECONNECT_DATA_TIMEOUT = float(os.getenv("RECONNECT_DATA_TIMEOUT", "5"))
+RECONNECT_BACKOFF_MS = int(os.getenv("RECONNECT_BACKOFF_MS", "500"))
+RECONNECT_BACKOFF_MAX_MS = int(os.getenv("RECONNECT_BACKOFF_MAX_MS", "30000"))
+RECONNECT_GRACE = float(os.getenv("RECONNECT_GRACE", "60"))  # Outages up to this many seconds keep the tracked objects
+SHM_RING_PATH = os.getenv("SHM_RING_PATH")
+SHM_RING_SLOTS = int(os.getenv("SHM_RING_SLOTS", "64"))
+WORKER_RESTART_DELAY = 5.0  # Seconds before a worker process that died is started again
+
+# Tracking Notification Topics
+entering_topic = "tns1:IVA/EnteringField/Entering_field"
+leaving_topic = "tns1:IVA/LeavingField/Leaving_field"
+
+
+def load_sources():
+    # RTSP_SOURCES points at a JSON list of {"name": ..., "url": ...}, RTSP_URLS is a comma separated fallback
+    config_path = os.getenv("RTSP_SOURCES")
+    if config_path:
+        with open(config_path) as config_file:
+            return json.load(config_file)
+    urls = [url.strip() for url in os.getenv("RTSP_URLS", os.getenv("RTSP_URL", "")).split(",") if url.strip()]
+    return [{"name": f"source-{index}", "url": url} for index, url in enumerate(urls)]
+
+
+def shard_sources(sources, worker_count):
+    shards = [[] for _ in range(worker_count)]
+    for index, source in enumerate(sources):
+        shards[index % worker_count].append(source)
+    return [shard for shard in shards if shard]
+
+
+class SourceProcessor:
+    # Reassembly, parsing, tracking and SDSM packing for one RTSP source; main3.py runs one,
+    # run_worker one per source. flush() hands every message to send(message), a memoryview into the
+    # encoder buffer that is only valid until the next flush. Stats and latency histograms are
+    # exported through metrics_registry when one is given, otherwise SDSM overflows are logged.
+
+    def __init__(self, name, send, metrics_registry=None, max_frame_size=MAX_FRAME_SIZE):
+        self.name = name
+        self.send = send
+        self.object_tracker = ObjectTracker(TRACKER_TTL, MAX_TRACKED_OBJECTS)  # Objects currently in the field of view
+        self.tracker_lock = threading.Lock()  # With STAGED_PIPELINE frames update the tracker on the worker while a reconnect resumes or clears it
+        self.frame_reassembler = FrameReassembler(max_frame_size)  # Reassembles frames from RTP sequence number, timestamp and marker bit
+        self.metadata_parser = MetadataStreamParser()
+        self.streaming = (STREAMING_PARSE or ZERO_COPY_RTP) and not STAGED_PIPELINE
+        self.process_worker = None  # Parses and tracks frames when STAGED_PIPELINE is enabled
+        if STAGED_PIPELINE:
+            self.process_worker = StageWorker(f"process-{name}", FrameQueue(FRAME_QUEUE_SIZE, FRAME_QUEUE_POLICY),
+                                              lambda item: self.process_metadata(*item))
+        self.sdsm_encoder = SdsmEncoder()  # Preallocated SDSM datagram buffer
+        self.utc_time_codec = UtcTimeCodec()  # Frame UtcTime -> epoch ms as UTC, parsed once per distinct value
+        self.frame_prefilter = FramePrefilter(PREFILTER_CLASSES) if FRAME_PREFILTER else None
+        self.metadata_backend = create_backend(PARSER_BACKEND)  # Parses whole frames, see parser_backends.py
+        self.change_filter = ChangeFilter(DELTA_POSITION_M, DELTA_SPEED_MPS, DELTA_HEADING_DEG,
+                                          DELTA_KEEPALIVE_MS / 1000) if DELTA_PUBLISHING else None
+        self.data_to_send = LatestState()  # Freshest record per object since the last flush
+        self.dropped_datagrams = 0
+        self.metrics_registry = metrics_registry
+        # Without a registry the histograms are kept but not exported
+        self.pipeline_metrics = PipelineMetrics(metrics_registry or MetricsRegistry())
+        if metrics_registry is not None:
+            metrics_registry.add_stats("rtsp_metadata_rtp", self.frame_reassembler.stats)
+            metrics_registry.add_stats("rtsp_metadata_tracker", self.object_tracker.stats)
+            if self.frame_prefilter is not None:
+                metrics_registry.add_stats("rtsp_metadata_prefilter", self.frame_prefilter.stats)
+            metrics_registry.add_stats("rtsp_metadata_utc_time", self.utc_time_codec.stats)
+            metrics_registry.add_stats("rtsp_metadata_sdsm", self.sdsm_encoder.stats, counters=("overflowed_objects",))
+            if self.change_filter is not None:
+                metrics_registry.add_stats("rtsp_metadata_delta", self.change_filter.stats)
+            if self.process_worker is not None:
+                metrics_registry.add_stats("rtsp_metadata_frame_queue", self.process_worker.stats)
+
+    def start(self):
+        if self.process_worker is not None:
+            self.process_worker.start()
+
+    def stop(self):
+        if self.process_worker is not None:
+            self.process_worker.stop()
+
+    def handle_packet(self, packet):
+        sequence_number, timestamp, marker, ssrc, payload_start, payload_end = parse_rtp_header(packet)
+        self.pipeline_metrics.packet_arrived(timestamp)
+        with memoryview(packet)[payload_start:payload_end] as payload_body:
+            if self.streaming:
+                flags = self.frame_reassembler.check(sequence_number, timestamp, marker, len(payload_body), ssrc)
+                if flags & FRAGMENT_RESET:
+                    self.metadata_parser.reset()
+                if flags & FRAGMENT_FEED:
+                    self.process_fragment(payload_body)
+                return
+            frame = self.frame_reassembler.push(sequence_number, timestamp, marker, payload_body, ssrc)
+        if frame is None:
+            return
+        arrival_ns = self.pipeline_metrics.frame_completed()
+        if self.frame_prefilter is not None and not self.frame_prefilter.wants(frame):
+            return  # Nothing in this frame can change the tracker or the output
+        if self.process_worker is not None:
+            self.process_worker.queue.put((frame, arrival_ns))
+        else:
+            self.process_metadata(frame, arrival_ns)
+
+    def resume(self, outage):
+        # Runs before the first packet after a reconnect, which belongs to a new RTP session. After a
+        # short outage the tracked objects are kept and the outage does not count against their TTL,
+        # after a longer one the camera has most likely restarted and renumbered its objects.
+        self.frame_reassembler.resync()
+        self.metadata_parser.reset()
+        with self.tracker_lock:
+            if outage <= RECONNECT_GRACE:
+                self.object_tracker.resume(outage)
+            else:
+                self.object_tracker.clear()
+
+    def process_fragment(self, fragment):
+        try:
+            started_ns = time.perf_counter_ns()
+            frame = self.metadata_parser.feed(fragment, self._process_notification)
+            self.pipeline_metrics.fragment_parsed(started_ns)
+            if frame is not None:
+                arrival_ns = self.pipeline_metrics.fragments_completed()
+                utc_time, objects_by_id = frame
+                started_ns = time.perf_counter_ns()
+                data_by_object_id = self._select_tracked_objects(objects_by_id)
+                self.pipeline_metrics.lap(self.pipeline_metrics.extract, started_ns)
+                self.pipeline_metrics.frame_processed(arrival_ns, len(objects_by_id), len(data_by_object_id))
+                self.data_to_send.update(data_by_object_id)
+        except ET.ParseError as parse_error:
+            self.pipeline_metrics.parse_errors.inc()
+            print(f"[{self.name}] Error parsing XML data: {parse_error}", flush=True)
+        except Exception as e:
+            print(f"[{self.name}] An unexpected error occurred in process_fragment: {e}", flush=True)
+
+    def process_metadata(self, data, arrival_ns=None):
+        try:
+            started_ns = time.perf_counter_ns()
+            notifications, objects_by_id = self.metadata_backend.parse(data)
+            with self.tracker_lock:
+                for topic, object_ids in notifications:
+                    self._apply_notification(topic, object_ids)
+                parsed_ns = self.pipeline_metrics.lap(self.pipeline_metrics.parse, started_ns)
+                data_by_object_id = self._select_tracked_objects(objects_by_id)
+            self.pipeline_metrics.lap(self.pipeline_metrics.extract, parsed_ns)
+            self.pipeline_metrics.frame_processed(arrival_ns, len(objects_by_id), len(data_by_object_id))
+            self.data_to_send.update(data_by_object_id)
+        except ET.ParseError as parse_error:
+            self.pipeline_metrics.parse_errors.inc()
+            print(f"[{self.name}] Error parsing XML data: {parse_error}", flush=True)
+        except Exception as e:
+            print(f"[{self.name}] An unexpected error occurred in process_metadata: {e}", flush=True)
+
+    def _process_notification(self, notification_message):
+        self._apply_notification(notification_topic(notification_message), notification_object_ids(notification_message))
+
+    def _apply_notification(self, topic, object_ids):
+        if topic == entering_topic:
+            for object_id in object_ids:
+                self.object_tracker.add(object_id)
+        elif topic == leaving_topic:
+            for object_id in object_ids:
+                self.object_tracker.remove(object_id)
+
+    def _select_tracked_objects(self, objects_by_id):
+        # Tracked objects are looked up in the per-frame index instead of rescanning the document
+        now = time.monotonic()
+        data_by_object_id = {}
+        for object_id, tracked in self.object_tracker.items():
+            object_data = objects_by_id.get(object_id)
+            if object_data:
+                tracked.last_seen = now
+                tracked.utc_time = object_data.get("utc_time")
+                tracked.class_candidate_type = object_data.get("class_candidate_type")
+                # Remember the first known position, the bearing itself is computed at flush time
+                if tracked.lat is None and "lat" in object_data:
+                    tracked.lat = float(object_data["lat"])
+                    tracked.lon = float(object_data["lon"])
+                data_by_object_id[object_id] = object_data
+        self.object_tracker.expire(now)
+        return data_by_object_id
+
+    def flush(self):
+        # Encode everything seen since the last flush and hand it to send
+        data_by_object_id = self.data_to_send.take()
+        if not data_by_object_id:
+            return
+        try:
+            started_ns = time.perf_counter_ns()
+            # Collect the Human objects column by column, bearing, unit conversion and packing run over the whole batch
+            object_ids, times_ms, latitudes, longitudes, elevations, speeds = [], [], [], [], [], []
+            previous_latitudes, previous_longitudes, tracked_objects = [], [], []
+            for object_id, value in data_by_object_id.items():
+                if value.get("utc_time") and value.get("class_candidate_type") == "Human":
+                    tracked = self.object_tracker.get(object_id)
+                    if tracked is None:
+                        continue  # Object left the field since this frame was parsed
+                    if not value.get("lat") or not value.get("lon"):
+                        continue  # No GeoLocation, an SDSM record needs a position
+                    times_ms.append(self.utc_time_codec.to_epoch_ms(value.get("utc_time")))
+                    object_ids.append(int(object_id))
+                    latitudes.append(float(value.get("lat")))
+                    longitudes.append(float(value.get("lon")))
+                    elevations.append(value.get("elevation") or 0)  # Missing elevation and speed are sent as 0
+                    speeds.append(value.get("Speed") or 0)
+                    # An object sent for the first time has no previous position, its bearing is 0
+                    previous_latitudes.append(latitudes[-1] if tracked.lat is None else tracked.lat)
+                    previous_longitudes.append(longitudes[-1] if tracked.lon is None else tracked.lon)
+                    tracked_objects.append(tracked)
+            capture_time_ms = max(times_ms, default=0)  # Newest frame UtcTime in this message
+
+            # Bearing from the previously sent position of every object
+            headings = calculate_bearings(previous_latitudes, previous_longitudes, latitudes, longitudes)
+            for tracked, current_lat, current_lon in zip(tracked_objects, latitudes, longitudes):
+                tracked.lat = current_lat
+                tracked.lon = current_lon
+
+            if self.change_filter is not None:
+                object_ids, times_ms, latitudes, longitudes, elevations, speeds, headings = self.change_filter.apply(
+                    object_ids, times_ms, latitudes, longitudes, elevations, speeds, headings)
+                if not object_ids:
+                    self.pipeline_metrics.discard_pending()
+                    return  # Nothing changed since the last message
+
+            self.sdsm_encoder.reset()
+            packed = self.sdsm_encoder.add_objects(object_ids, OBJECT_TYPE_HUMAN, times_ms, latitudes, longitudes,
+                                                   elevations, speeds, headings)
+            if packed < len(object_ids) and self.metrics_registry is None:
+                print(f"[{self.name}] SDSM message full, {len(object_ids) - packed} objects left out "
+                      f"({self.sdsm_encoder.overflowed_objects} so far)", flush=True)
+            # Header carries the number of records actually packed
+            message = self.sdsm_encoder.finish()
+            packed_ns = self.pipeline_metrics.lap(self.pipeline_metrics.pack, started_ns)
+            self.send(message)
+            self.pipeline_metrics.lap(self.pipeline_metrics.send, packed_ns)
+            self.pipeline_metrics.published(len(message), capture_time_ms)
+        except queue.Full:
+            self.dropped_datagrams += 1
+        except Exception as e:
+            print(f"[{self.name}] An error occurred in flush: {e}", flush=True)
+
+
+def run_worker(sources, output_queue):
+    # Entry point of a worker process, GStreamer is only imported and initialised here
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import GLib, Gst
+    from gst_runtime import PipelineSupervisor, build_pipeline
+
+    Gst.init(None)
+    loop = GLib.MainLoop()
+
+    def flush_all():
+        for processor in processors:
+            processor.flush()
+
+    def send(message):
+        output_queue.put_nowait(message.tobytes())  # queue.Full is counted by the processor
+
+    processors = []
+    supervisors = []
+    for source in sources:
+        processor = SourceProcessor(source["name"], send)
+        # Each source reconnects on its own, the others keep streaming on the shared main loop
+        supervisors.append(PipelineSupervisor(
+            lambda url=source["url"]: build_pipeline(url, JITTERBUFFER_LATENCY_MS, APPSINK_MAX_BUFFERS, APPSINK_DROP, APPSINK_SYNC),
+            lambda buffer, processor=processor: processor.handle_packet(buffer.extract_dup(0, buffer.get_size())),
+            APPSINK_PULL, RECONNECT_DATA_TIMEOUT, RECONNECT_BACKOFF_MS / 1000, RECONNECT_BACKOFF_MAX_MS / 1000,
+            processor.resume, loop=loop, name=processor.name))
+        processors.append(processor)
+
+    publisher = FixedRatePublisher(SEND_INTERVAL_MS / 1000, flush_all)
+    publisher.start()
+    try:
+        for processor in processors:
+            processor.start()
+        for supervisor in supervisors:
+            supervisor.start()
+        loop.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        publisher.stop()
+        for supervisor in supervisors:
+            supervisor.stop()
+        for processor in processors:
+            processor.stop()
+
+def main():
+    sources = load_sources()
+    if not sources:
+        print("No RTSP sources configured, set RTSP_SOURCES or RTSP_URLS", flush=True)
+        return
+
+    worker_count = int(os.getenv("SOURCE_WORKERS", str(os.cpu_count() or 1)))
+    shards = shard_sources(sources, max(1, min(worker_count, len(sources))))
+    context = multiprocessing.get_context("spawn")  # GLib state must not be inherited through fork
+    output_queue = context.Queue(OUTPUT_QUEUE_SIZE)
+    udp_sender = UdpSender(parse_destinations(UDP_DESTINATIONS))
+    shm_ring = ShmRingWriter(SHM_RING_PATH, SHM_RING_SLOTS) if SHM_RING_PATH else None  # Messages of all sources in one ring
+
+    workers = [None] * len(shards)
+    restart_at = [0.0] * len(shards)
+    print(f"Serving {len(sources)} sources on {len(shards)} worker processes", flush=True)
+    try:
+        while True:
+            now = time.monotonic()
+            for index, shard in enumerate(shards):
+                worker = workers[index]
+                if worker is not None and not worker.is_alive():
+                    print(f"Worker for {[source['name'] for source in shard]} exited with {worker.exitcode}", flush=True)
+                    workers[index] = worker = None
+                    restart_at[index] = now + WORKER_RESTART_DELAY
+                if worker is None and now >= restart_at[index]:
+                    workers[index] = context.Process(target=run_worker, args=(shard, output_queue), daemon=True)
+                    workers[index].start()
+
+            try:
+                message = output_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if shm_ring is not None:
+                shm_ring.write(message)
+            udp_sender.send(message)
+    except KeyboardInterrupt:
+        print("Application stopped by user", flush=True)
+    finally:
+        for worker in workers:
+            if worker is not None:
+                worker.terminate()
+        udp_sender.close()
+        if shm_ring is not None:
+            shm_ring.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import io
+import xml.etree.ElementTree as ET
+import xml.parsers.expat
+from metadata_stream import (NOTIFICATION_MESSAGE_TAG, OBJECT_TAG, FRAME_TAG, TT_NAMESPACE, WSNT_NAMESPACE,
+                             index_objects, notification_object_ids, notification_topic)
+
+try:
+    import lxml.etree as LET
+except ImportError:  # The stdlib backends are always available
+    LET = None
+
+# Interchangeable parsers for complete MetadataStream frames. parse(data) returns
+# (notifications, objects_by_id): notifications is a list of (topic, [ObjectId, ...]) in document
+# order, objects_by_id maps ObjectId to the same records index_objects() produces. Malformed input,
+# including a NotificationMessage without Topic or a ClassCandidate without Type or Likelihood,
+# raises ET.ParseError whatever the backend. test_parser_backends.py holds the backends to this.
+
+CENTER_OF_GRAVITY_TAG = f"{{{TT_NAMESPACE}}}CenterOfGravity"
+CLASS_CANDIDATE_TAG = f"{{{TT_NAMESPACE}}}ClassCandidate"
+GEOLOCATION_TAG = f"{{{TT_NAMESPACE}}}GeoLocation"
+SPEED_TAG = f"{{{TT_NAMESPACE}}}Speed"
+TYPE_TAG = f"{{{TT_NAMESPACE}}}Type"
+LIKELIHOOD_TAG = f"{{{TT_NAMESPACE}}}Likelihood"
+TOPIC_TAG = f"{{{WSNT_NAMESPACE}}}Topic"
+MESSAGE_TAG = f"{{{TT_NAMESPACE}}}Message"
+KEY_TAG = f"{{{TT_NAMESPACE}}}Key"
+
+
+def _stamp_utc_time(objects_by_id, utc_time):
+    # Every object takes the UtcTime of the first tt:Frame, as in index_objects
+    if utc_time:
+        for object_data in objects_by_id.values():
+            object_data["utc_time"] = utc_time  # Raw, UtcTimeCodec reads the Z or the offset
+    return objects_by_id
+
+
+class ElementTreeBackend:
+    # Reference implementation: full tree from the stdlib parser, fields looked up with find()
+    name = "etree"
+
+    def parse(self, data):
+        root = ET.fromstring(data)
+        try:
+            notifications = [(notification_topic(notification_message), notification_object_ids(notification_message))
+                             for notification_message in root.iter(NOTIFICATION_MESSAGE_TAG)]
+            return notifications, index_objects(root)
+        except AttributeError:
+            # find() came back empty for a wsnt:Topic or a tt:Type/tt:Likelihood the frame must carry
+            raise ET.ParseError("NotificationMessage without Topic or ClassCandidate without Type/Likelihood") from None
+
+
+class _FrameEvents:
+    # Rebuilds what ElementTreeBackend returns from start/end events, keeping no elements. A field goes
+    # to every open tt:Object that has no value for it yet, which is what find(".//...") on each object
+    # gives, and only the first tt:Object of an ObjectId gets a record.
+    #
+    # start() returns True when the element's text is needed; the caller then passes the text before
+    # its first child (Element.text) to text() ahead of end().
+
+    def __init__(self):
+        self.notifications = []
+        self.objects_by_id = {}
+        self.utc_time = None
+        self.depth = 0
+        self._frame_seen = False
+        self._parents = []
+        self._objects = []  # [depth, record or None, depth of the first ClassCandidate, 0 once it closed]
+        self._notifications = []  # [depth, [topic, object_ids], Topic seen, tt:Key depth, tt:Key seen]
+        self._text_targets = {}  # depth -> [(dict or list, key), ...] the element's text is stored in
+
+    def start(self, tag, attrs):
+        self.depth += 1
+        depth = self.depth
+        parent = self._parents[-1] if self._parents else None
+        self._parents.append(tag)
+        targets = []
+
+        for notification in self._notifications:
+            if notification[3] is not None and depth == notification[3] + 1:
+                notification[1][1].append(attrs.get("Value"))
+            elif tag == TOPIC_TAG and depth == notification[0] + 1 and not notification[2]:
+                notification[2] = True
+                targets.append((notification[1], 0))
+            elif tag == KEY_TAG and parent == MESSAGE_TAG and depth > notification[0] + 2 and not notification[4]:
+                notification[3] = depth
+                notification[4] = True
+
+        if tag == OBJECT_TAG:
+            object_id = attrs.get("ObjectId")
+            record = None if object_id in self.objects_by_id else self.objects_by_id.setdefault(object_id, {})
+            self._objects.append([depth, record, None])
+        elif tag == NOTIFICATION_MESSAGE_TAG:
+            entry = [None, []]
+            self.notifications.append(entry)
+            self._notifications.append([depth, entry, False, None, False])
+        elif tag == FRAME_TAG:
+            if not self._frame_seen and depth > 1:  # find(".//tt:Frame") does not look at the root
+                self._frame_seen = True
+                self.utc_time = attrs.get("UtcTime")
+        elif tag == CENTER_OF_GRAVITY_TAG:
+            for _, record, _ in self._objects:
+                if record is not None and "x" not in record:
+                    record["x"] = attrs.get("x")
+                    record["y"] = attrs.get("y")
+        elif tag == GEOLOCATION_TAG:
+            for _, record, _ in self._objects:
+                if record is not None and "lat" not in record:
+                    record["lat"] = attrs.get("lat")
+                    record["lon"] = attrs.get("lon")
+                    record["elevation"] = attrs.get("elevation")
+        elif tag == SPEED_TAG:
+            for _, record, _ in self._objects:
+                if record is not None and "Speed" not in record:
+                    record["Speed"] = None
+                    targets.append((record, "Speed"))
+        elif tag == CLASS_CANDIDATE_TAG:
+            for entry in self._objects:
+                if entry[1] is not None and entry[2] is None:
+                    entry[2] = depth
+        elif tag == TYPE_TAG or tag == LIKELIHOOD_TAG:
+            key = "class_candidate_type" if tag == TYPE_TAG else "likelihood"
+            for _, record, candidate_depth in self._objects:
+                if candidate_depth and key not in record:
+                    record[key] = None
+                    targets.append((record, key))
+
+        if targets:
+            self._text_targets[depth] = targets
+            return True
+        return False
+
+    def text(self, text):
+        for target, key in self._text_targets.pop(self.depth):
+            target[key] = text
+
+    def end(self, tag):
+        depth = self.depth
+        self._parents.pop()
+        if tag == OBJECT_TAG:
+            self._objects.pop()
+        elif tag == NOTIFICATION_MESSAGE_TAG:
+            if not self._notifications.pop()[2]:
+                raise ET.ParseError("NotificationMessage without Topic")
+        elif tag == KEY_TAG:
+            for notification in self._notifications:
+                if notification[3] == depth:
+                    notification[3] = None
+        elif tag == CLASS_CANDIDATE_TAG:
+            for entry in self._objects:
+                if entry[2] == depth:
+                    entry[2] = 0  # Later candidates of the object are ignored
+                    if "class_candidate_type" not in entry[1] or "likelihood" not in entry[1]:
+                        raise ET.ParseError("ClassCandidate without Type/Likelihood")
+        self.depth -= 1
+
+    def result(self):
+        notifications = [(topic, object_ids) for topic, object_ids in self.notifications]
+        return notifications, _stamp_utc_time(self.objects_by_id, self.utc_time)
+
+
+class ExpatBackend:
+    # pyexpat callbacks, no tree is built. Only the attributes and texts that are published are kept,
+    # so memory does not grow with the number of elements in a frame.
+    name = "expat"
+
+    def parse(self, data):
+        parser = xml.parsers.expat.ParserCreate(namespace_separator="}")
+        parser.buffer_text = True
+        events = _FrameEvents()
+        text_parts = []
+        text_open = False  # Collecting the text of the innermost open element
+
+        def start(name, attrs):
+            nonlocal text_open
+            if text_open:  # Element.text stops at the first child
+                events.text("".join(text_parts) or None)
+            # expat reports "ns}Tag", the same Clark notation as ElementTree once "{" is added
+            text_open = events.start("{" + name, attrs)
+            text_parts.clear()
+
+        def end(name):
+            nonlocal text_open
+            if text_open:
+                events.text("".join(text_parts) or None)
+                text_open = False
+            events.end("{" + name)
+
+        def character_data(text):
+            if text_open:
+                text_parts.append(text)
+
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = character_data
+        try:
+            parser.Parse(data, True)
+        except xml.parsers.expat.ExpatError as expat_error:
+            raise ET.ParseError(str(expat_error)) from None
+        return events.result()
+
+
+class LxmlBackend:
+    # libxml2 iterparse, every element is cleared once its end event is handled, so like expat the
+    # memory held does not grow with the number of elements in a frame
+    name = "lxml"
+
+    def parse(self, data):
+        events = _FrameEvents()
+        wants_text = []
+        try:
+            for event, elem in LET.iterparse(io.BytesIO(data), events=("start", "end"), remove_comments=True):
+                if event == "start":
+                    wants_text.append(events.start(elem.tag, elem.attrib))
+                    continue
+                if wants_text.pop():
+                    events.text(elem.text)
+                events.end(elem.tag)
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]  # Handled siblings, the root would keep them otherwise
+        except LET.XMLSyntaxError as syntax_error:
+            raise ET.ParseError(str(syntax_error)) from None
+        return events.result()
+
+
+BACKENDS = {backend.name: backend for backend in (ElementTreeBackend, ExpatBackend, LxmlBackend)}
+
+
+def available_backends():
+    return [name for name in BACKENDS if name != LxmlBackend.name or LET is not None]
+
+
+def create_backend(name="auto"):
+    # "auto" takes expat, the fastest of the three and always available
+    if name == "auto":
+        name = ExpatBackend.name
+    if name not in available_backends():
+        raise ValueError(f"Parser backend {name!r} is not available, expected one of {available_backends()}")
+    return BACKENDS[name]()
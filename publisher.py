@@ -0,0 +1,73 @@
+import threading
+import time
+
+
+class LatestState:
+    # Freshest record per ObjectId between two publishes. Processing threads update it, the
+    # publisher takes the whole mapping in one swap.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records = {}
+
+    def update(self, records):
+        with self._lock:
+            self._records.update(records)
+
+    def take(self):
+        with self._lock:
+            records, self._records = self._records, {}
+        return records
+
+    def __len__(self):
+        return len(self._records)
+
+
+class FixedRatePublisher(threading.Thread):
+    # Calls publish() at absolute deadlines start + n * interval on the monotonic clock, so the period
+    # neither drifts by the publish cost nor jumps when the wall clock is adjusted. When a tick is a
+    # whole interval or more late the missed deadlines are counted and skipped rather than sent in a burst.
+
+    def __init__(self, interval, publish, name="publisher"):
+        super().__init__(name=name, daemon=True)
+        self.interval = interval
+        self.publish = publish
+        self.ticks = 0
+        self.missed_deadlines = 0
+        self.max_jitter = 0.0
+        self.busy_seconds = 0.0
+        self._total_jitter = 0.0
+        self._stopped = threading.Event()
+
+    def run(self):
+        deadline = time.monotonic() + self.interval
+        while not self._stopped.wait(max(0.0, deadline - time.monotonic())):
+            started = time.monotonic()
+            jitter = started - deadline
+            if jitter >= self.interval:
+                missed = int(jitter // self.interval)
+                self.missed_deadlines += missed
+                deadline += missed * self.interval
+                jitter -= missed * self.interval
+            self.ticks += 1
+            self._total_jitter += jitter
+            self.max_jitter = max(self.max_jitter, jitter)
+            try:
+                self.publish()
+            except Exception as e:
+                print(f"An error occurred in {self.name}: {e}", flush=True)
+            self.busy_seconds += time.monotonic() - started
+            deadline += self.interval
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self.join(timeout)
+
+    def stats(self):
+        return {
+            "ticks": self.ticks,
+            "missed_deadlines": self.missed_deadlines,
+            "mean_jitter_seconds": self._total_jitter / self.ticks if self.ticks else 0.0,
+            "max_jitter_seconds": self.max_jitter,
+            "busy_seconds": self.busy_seconds,
+        }
@@ -0,0 +1,157 @@
+import struct
+from contextlib import contextmanager
+
+RTP_HEADER = struct.Struct("!BBHII")  # V/P/X/CC, M/PT, sequence number, timestamp, SSRC
+RTP_EXTENSION_HEADER = struct.Struct("!HH")  # profile, length in 32-bit words
+
+
+def parse_rtp_header(packet):
+    # Returns (sequence_number, timestamp, marker, ssrc, payload_start, payload_end) for a bytes-like packet
+    first, second, sequence_number, timestamp, ssrc = RTP_HEADER.unpack_from(packet)
+    payload_start = RTP_HEADER.size + 4 * (first & 0x0F)
+    if first & 0x10:
+        _profile, extension_length = RTP_EXTENSION_HEADER.unpack_from(packet, payload_start)
+        payload_start += RTP_EXTENSION_HEADER.size + 4 * extension_length
+    payload_end = len(packet)
+    if first & 0x20:
+        payload_end -= packet[-1]
+    return sequence_number, timestamp, bool(second & 0x80), ssrc, payload_start, payload_end
+
+
+@contextmanager
+def map_buffer(buffer, flags):
+    # Read-only memoryview over a Gst.Buffer, unmapped as soon as the with block exits
+    result = buffer.map(flags)
+    if isinstance(result, tuple):
+        mapped, map_info = result  # Plain PyGObject returns (success, MapInfo)
+    else:
+        mapped, map_info = True, result  # gst-python overrides return the MapInfo itself
+    if not mapped:
+        raise RuntimeError("Unable to map GStreamer buffer")
+
+    view = memoryview(map_info.data)
+    try:
+        yield view
+    finally:
+        view.release()
+        buffer.unmap(map_info)
+
+
+# Flags returned by FrameReassembler.check
+FRAGMENT_RESET = 1  # Discard any partially assembled frame before handling this payload
+FRAGMENT_FEED = 2  # Payload belongs to a healthy frame
+FRAGMENT_END = 4  # Payload completes the frame
+
+MAX_FRAME_SIZE = 1024 * 1024
+MAX_MISORDER = 100  # Packets a reordered packet may lag behind, a longer backward jump is a new session (RFC 3550 A.1)
+
+
+class FrameReassembler:
+    # Groups RTP payloads into MetadataStream documents using the sequence number, timestamp and
+    # marker bit. Frames with a sequence gap or over max_frame_size are dropped without being parsed.
+    # A new SSRC, or a sequence number more than MAX_MISORDER behind, means the sender restarted.
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self.completed_frames = 0
+        self.dropped_frames = 0
+        self.oversized_frames = 0
+        self.lost_packets = 0
+        self.late_packets = 0
+        self.sequence_resets = 0
+        self._buffer = bytearray()
+        self.resync()
+
+    def resync(self):
+        # Forget the sequence position and any partial frame, a reconnect starts a new RTP session
+        # whose sequence numbers are unrelated to the old ones
+        self._buffer.clear()
+        self._ssrc = None
+        self._expected_sequence = None
+        self._synchronized = False  # Until the first marker bit we may have joined mid-frame
+        self._in_frame = False
+        self._damaged = False
+        self._timestamp = None
+        self._frame_size = 0
+
+    def check(self, sequence_number, timestamp, marker, payload_size, ssrc=None):
+        # Sequencing only, for callers that consume the payload themselves
+        gap = 0
+        if self._expected_sequence is not None:
+            gap = (sequence_number - self._expected_sequence) & 0xFFFF
+            backward = 0x10000 - gap if gap >= 0x8000 else 0  # How far behind the current position
+            if ssrc != self._ssrc or backward > MAX_MISORDER:
+                # New sender, or a jump too far back to be reordering: start over at this packet
+                self.sequence_resets += 1
+                self.resync()
+                gap = 0
+            elif backward:
+                self.late_packets += 1  # Duplicate or reordered packet from before the current position
+                return 0
+            else:
+                self.lost_packets += gap
+        self._ssrc = ssrc
+        self._expected_sequence = (sequence_number + 1) & 0xFFFF
+
+        if not self._synchronized:
+            if marker:
+                self._synchronized = True
+            return FRAGMENT_RESET
+
+        flags = 0
+        if not self._in_frame or timestamp != self._timestamp:
+            if self._in_frame and not self._damaged:
+                self.dropped_frames += 1  # Previous frame never saw its marker bit
+            self._in_frame = True
+            self._damaged = False
+            self._timestamp = timestamp
+            self._frame_size = 0
+            flags |= FRAGMENT_RESET
+            if gap:
+                self._mark_damaged()  # The lost packets may have been the head of this frame
+        elif gap and not self._damaged:
+            self._mark_damaged()
+            flags |= FRAGMENT_RESET
+
+        if not self._damaged:
+            self._frame_size += payload_size
+            if self._frame_size > self.max_frame_size:
+                self.oversized_frames += 1
+                self._mark_damaged()
+                flags |= FRAGMENT_RESET
+            else:
+                flags |= FRAGMENT_FEED
+
+        if marker:
+            self._in_frame = False
+            if not self._damaged:
+                self.completed_frames += 1
+                flags |= FRAGMENT_END
+        return flags
+
+    def push(self, sequence_number, timestamp, marker, payload, ssrc=None):
+        # Buffers payloads and returns the complete frame as bytes, or None while it is still incomplete
+        flags = self.check(sequence_number, timestamp, marker, len(payload), ssrc)
+        if flags & FRAGMENT_RESET:
+            self._buffer.clear()
+        if flags & FRAGMENT_FEED:
+            self._buffer += payload
+        if flags & FRAGMENT_END:
+            frame = bytes(self._buffer)
+            self._buffer.clear()
+            return frame
+        return None
+
+    def stats(self):
+        return {
+            "completed_frames": self.completed_frames,
+            "dropped_frames": self.dropped_frames,
+            "oversized_frames": self.oversized_frames,
+            "lost_packets": self.lost_packets,
+            "late_packets": self.late_packets,
+            "sequence_resets": self.sequence_resets,
+        }
+
+    def _mark_damaged(self):
+        self._damaged = True
+        self.dropped_frames += 1
@@ -0,0 +1,111 @@
+import struct
+
+try:
+    import numpy as np
+except ImportError:  # add_objects falls back to one add() per object
+    np = None
+
+SDSM_MAGIC = 0xdeadbeef
+HEADER = struct.Struct("Ii")  # magic, number of objects
+OBJECT_RECORD = struct.Struct("IIQiiiiii")  # id, type, time ms, lat, lon, elevation, speed, heading, pad
+MAX_OBJECTS = 512
+
+OBJECT_TYPE_UNKNOWN = 0
+OBJECT_TYPE_VEHICLE = 1
+OBJECT_TYPE_HUMAN = 2
+OBJECT_TYPE_ANIMAL = 3
+# ONVIF ClassCandidate types -> SDSM object type, anything else is sent as unknown
+OBJECT_TYPES = {
+    "Human": OBJECT_TYPE_HUMAN,
+    "Vehicle": OBJECT_TYPE_VEHICLE,
+    "Vehical": OBJECT_TYPE_VEHICLE,  # Spelling of the ONVIF 1.0 schema, still sent by some cameras
+    "Animal": OBJECT_TYPE_ANIMAL,
+}
+
+if np is not None:
+    # Structured view of OBJECT_RECORD, the offsets are taken from struct so the layouts always agree
+    _RECORD_FIELDS = ("object_id", "object_type", "time_ms", "latitude", "longitude", "elevation", "speed", "heading", "pad")
+    _RECORD_CODES = "IIQiiiiii"
+    RECORD_DTYPE = np.dtype({
+        "names": _RECORD_FIELDS,
+        "formats": ["=u4", "=u4", "=u8", "=i4", "=i4", "=i4", "=i4", "=i4", "=i4"],
+        "offsets": [struct.calcsize(_RECORD_CODES[:index + 1]) - struct.calcsize(code)
+                    for index, code in enumerate(_RECORD_CODES)],
+        "itemsize": OBJECT_RECORD.size,
+    })
+
+
+def _int32_field(column):
+    # Truncates like int(). NaN (a missing field), inf and values outside int32 raise ValueError,
+    # as int() and struct do on the scalar path, instead of astype() writing INT_MIN or wrapping.
+    if not np.isfinite(column).all() or (np.abs(column) >= 2 ** 31).any():
+        raise ValueError("SDSM field is missing, not a number or out of range")
+    return column.astype(np.int32)
+
+
+class SdsmEncoder:
+    # Packs the SDSM datagram into one preallocated buffer sized for max_objects records.
+    # The memoryview returned by finish() is only valid until the next reset().
+
+    def __init__(self, max_objects=MAX_OBJECTS):
+        self.max_objects = max_objects
+        self.count = 0
+        self.overflowed_objects = 0
+        self._buffer = bytearray(HEADER.size + OBJECT_RECORD.size * max_objects)
+        self._view = memoryview(self._buffer)
+
+    def reset(self):
+        self.count = 0
+
+    def stats(self):
+        # Objects that did not fit in max_objects records and were left out of their message
+        return {"overflowed_objects": self.overflowed_objects}
+
+    def add(self, object_id, object_type, time_ms, latitude, longitude, elevation, speed, heading):
+        if self.count >= self.max_objects:
+            self.overflowed_objects += 1
+            return False
+        OBJECT_RECORD.pack_into(self._buffer, HEADER.size + self.count * OBJECT_RECORD.size,
+                                object_id, object_type, time_ms, latitude, longitude,
+                                elevation, speed, heading, 0)
+        self.count += 1
+        return True
+
+    def add_objects(self, object_ids, object_type, times_ms, latitudes, longitudes, elevations, speeds, headings):
+        # Converts and packs a whole frame at once. Positions in degrees, elevation in m and speed in m/s
+        # (floats or numeric strings as parsed from the XML), headings already in 0.0125 degree units.
+        # Returns the number of objects packed.
+        count = min(len(object_ids), self.max_objects - self.count)
+        self.overflowed_objects += len(object_ids) - count
+        if count <= 0:
+            return 0
+        if np is None:
+            for index in range(count):
+                self.add(object_ids[index], object_type, times_ms[index],
+                         int(float(latitudes[index]) * 1e7), int(float(longitudes[index]) * 1e7),
+                         int(float(elevations[index]) / 10), int(float(speeds[index]) * 50), headings[index])
+            return count
+
+        records = np.frombuffer(self._buffer, dtype=RECORD_DTYPE, count=count,
+                                offset=HEADER.size + self.count * OBJECT_RECORD.size)
+        records["object_id"] = object_ids[:count]
+        records["object_type"] = object_type
+        records["time_ms"] = times_ms[:count]
+        # Everything is converted and checked before the first record is written
+        latitude = _int32_field(np.asarray(latitudes[:count], dtype=np.float64) * 1e7)  # 1e-7 degrees
+        longitude = _int32_field(np.asarray(longitudes[:count], dtype=np.float64) * 1e7)
+        elevation = _int32_field(np.asarray(elevations[:count], dtype=np.float64) / 10)
+        speed = _int32_field(np.asarray(speeds[:count], dtype=np.float64) * 50)  # 0.02 m/s
+        heading = _int32_field(np.asarray(headings[:count], dtype=np.float64))
+        records["latitude"] = latitude
+        records["longitude"] = longitude
+        records["elevation"] = elevation
+        records["speed"] = speed
+        records["heading"] = heading
+        records["pad"] = 0
+        self.count += count
+        return count
+
+    def finish(self):
+        HEADER.pack_into(self._buffer, 0, SDSM_MAGIC, self.count)
+        return self._view[:HEADER.size + self.count * OBJECT_RECORD.size]
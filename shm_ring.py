@@ -0,0 +1,163 @@
+import mmap
+import os
+import struct
+from sdsm import HEADER, MAX_OBJECTS, OBJECT_RECORD
+
+# Single-producer ring of SDSM messages in a memory-mapped file, for consumers on the same host.
+# The file (by default in /dev/shm, so it lives in RAM) holds a ring header and slot_count fixed-size
+# slots. Frame n (n = 1, 2, ...) goes to slot (n - 1) % slot_count. The writer clears the slot's
+# sequence, stores the length, copies the message, then publishes the slot sequence and finally the
+# ring's write sequence. A reader reads the sequence, then the length, then the sequence again, so
+# one that sees sequence n both times knows the length and message belong to frame n. There are no
+# locks, readers never block the writer; a reader that falls slot_count frames behind loses frames.
+# The protocol relies on stores becoming visible in program order, as they do on x86; on weakly
+# ordered CPUs (ARM) a reader may see the new sequence before the message bytes.
+#
+#   ring header  magic u32, version u32, slot_count u32, slot_size u32, write_sequence u64, 40 pad bytes
+#   slot         sequence u64 (0 while being written), length u32, 4 pad bytes, message bytes
+
+RING_MAGIC = 0x53444d52  # "SDMR"
+RING_VERSION = 1
+RING_HEADER = struct.Struct("<IIIIQ40x")
+SLOT_HEADER = struct.Struct("<QI4x")
+SEQUENCE = struct.Struct("<Q")
+LENGTH = struct.Struct("<I")
+LENGTH_OFFSET = SEQUENCE.size  # Within a slot
+WRITE_SEQUENCE_OFFSET = 16
+SLOT_COUNT = 64  # 6.4 s of history at 10 Hz
+# Room for a full SdsmEncoder message, rounded up to a cache line
+SLOT_SIZE = (SLOT_HEADER.size + HEADER.size + OBJECT_RECORD.size * MAX_OBJECTS + 63) // 64 * 64
+DEFAULT_PATH = "/dev/shm/sdsm_ring"
+
+
+class ShmRingWriter:
+    # Producer side, one per ring. A ring file left by an earlier run with the same geometry is reused
+    # and its sequence continued, so attached readers keep working across producer restarts.
+
+    def __init__(self, path=DEFAULT_PATH, slot_count=SLOT_COUNT, slot_size=SLOT_SIZE):
+        self.path = path
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        self.written_frames = 0
+        self.written_bytes = 0
+        self.oversized_frames = 0
+        size = RING_HEADER.size + slot_count * slot_size
+        self._map = self._open(size)
+        self._view = memoryview(self._map)
+        magic, version, existing_slot_count, existing_slot_size, sequence = RING_HEADER.unpack_from(self._view)
+        if (magic, version, existing_slot_count, existing_slot_size) != (RING_MAGIC, RING_VERSION, slot_count, slot_size):
+            sequence = 0
+            self._view[:] = bytes(size)
+            RING_HEADER.pack_into(self._view, 0, RING_MAGIC, RING_VERSION, slot_count, slot_size, 0)
+        self.sequence = sequence
+
+    def _open(self, size):
+        if os.path.exists(self.path) and os.path.getsize(self.path) != size:
+            # Readers mapped the old geometry, give them a new file instead of rewriting theirs
+            os.unlink(self.path)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            return mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def write(self, message):
+        # Returns the sequence number of the frame, or 0 when it does not fit in a slot
+        length = len(message)
+        if length > self.slot_size - SLOT_HEADER.size:
+            self.oversized_frames += 1
+            return 0
+        sequence = self.sequence + 1
+        offset = RING_HEADER.size + (sequence - 1) % self.slot_count * self.slot_size
+        start = offset + SLOT_HEADER.size
+        SEQUENCE.pack_into(self._view, offset, 0)
+        LENGTH.pack_into(self._view, offset + LENGTH_OFFSET, length)
+        self._view[start:start + length] = message
+        SEQUENCE.pack_into(self._view, offset, sequence)  # Publishes the slot, after everything it covers
+        SEQUENCE.pack_into(self._view, WRITE_SEQUENCE_OFFSET, sequence)
+        self.sequence = sequence
+        self.written_frames += 1
+        self.written_bytes += length
+        return sequence
+
+    def close(self):
+        self._view.release()
+        self._map.close()
+
+    def stats(self):
+        return {
+            "sequence": self.sequence,
+            "written_frames": self.written_frames,
+            "written_bytes": self.written_bytes,
+            "oversized_frames": self.oversized_frames,
+        }
+
+
+class ShmRingReader:
+    # Consumer side. Frames are returned as read-only memoryviews into the shared mapping, nothing is
+    # copied. A view stays readable, but once the writer has lapped the ring the slot holds a newer
+    # frame; valid(sequence) tells whether a frame was still intact after it was used. All views must
+    # be released before close().
+    #
+    #   reader = ShmRingReader("/dev/shm/sdsm_ring")
+    #   for sequence, message in reader.read_new():
+    #       handle(message)
+    #       if not reader.valid(sequence):
+    #           ...  # overwritten while being handled, drop whatever was derived from it
+
+    def __init__(self, path=DEFAULT_PATH, from_start=False):
+        with open(path, "rb") as ring_file:
+            self._map = mmap.mmap(ring_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        magic, version, self.slot_count, self.slot_size, sequence = RING_HEADER.unpack_from(self._view)
+        if magic != RING_MAGIC or version != RING_VERSION:
+            self.close()
+            raise ValueError(f"{path} is not an SDSM ring (magic {magic:#x}, version {version})")
+        self.lost_frames = 0  # Overwritten before read_new() got to them
+        # The next frame read_new() returns, by default only frames written after the reader attached
+        self.next_sequence = max(1, sequence - self.slot_count + 1) if from_start else sequence + 1
+
+    def latest_sequence(self):
+        return SEQUENCE.unpack_from(self._view, WRITE_SEQUENCE_OFFSET)[0]
+
+    def read(self, sequence):
+        # The message of frame sequence, None when it is not written yet or already overwritten
+        offset = RING_HEADER.size + (sequence - 1) % self.slot_count * self.slot_size
+        if sequence == 0 or SEQUENCE.unpack_from(self._view, offset)[0] != sequence:
+            return None
+        length = LENGTH.unpack_from(self._view, offset + LENGTH_OFFSET)[0]
+        if SEQUENCE.unpack_from(self._view, offset)[0] != sequence or length > self.slot_size - SLOT_HEADER.size:
+            return None  # The writer started on the slot while the length was read
+        start = offset + SLOT_HEADER.size
+        return self._view[start:start + length]
+
+    def valid(self, sequence):
+        offset = RING_HEADER.size + (sequence - 1) % self.slot_count * self.slot_size
+        return SEQUENCE.unpack_from(self._view, offset)[0] == sequence
+
+    def read_latest(self):
+        # (sequence, message) of the newest frame, or None before the first one
+        sequence = self.latest_sequence()
+        message = self.read(sequence) if sequence else None
+        return (sequence, message) if message is not None else None
+
+    def read_new(self):
+        # Yields (sequence, message) for every frame written since the previous call, oldest first
+        latest = self.latest_sequence()
+        oldest = latest - self.slot_count + 1
+        if self.next_sequence < oldest:
+            self.lost_frames += oldest - self.next_sequence
+            self.next_sequence = oldest
+        while self.next_sequence <= latest:
+            sequence = self.next_sequence
+            self.next_sequence += 1
+            message = self.read(sequence)
+            if message is None:
+                self.lost_frames += 1  # Overwritten after latest was read
+                continue
+            yield sequence, message
+
+    def close(self):
+        self._view.release()
+        self._map.close()
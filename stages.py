@@ -0,0 +1,108 @@
+import collections
+import threading
+import time
+
+# Overflow policies for FrameQueue
+DROP_OLDEST = "drop-oldest"  # Evict the oldest queued frame to make room
+DROP_NEWEST = "drop-newest"  # Reject the incoming frame
+LATEST_WINS = "latest"  # Discard everything queued, only the newest frame is kept
+QUEUE_POLICIES = (DROP_OLDEST, DROP_NEWEST, LATEST_WINS)
+
+
+class FrameQueue:
+    # Bounded hand-off between pipeline stages. put() never blocks the producer, overflow is
+    # resolved by the configured policy and counted.
+
+    def __init__(self, maxsize, policy=DROP_OLDEST):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown queue policy {policy!r}, expected one of {QUEUE_POLICIES}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.enqueued = 0
+        self.dequeued = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self._items = collections.deque()
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def put(self, item):
+        with self._condition:
+            if self._closed:
+                return False
+            if len(self._items) >= self.maxsize:
+                if self.policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                if self.policy == LATEST_WINS:
+                    self.dropped += len(self._items)
+                    self._items.clear()
+                else:
+                    self._items.popleft()
+                    self.dropped += 1
+            self._items.append(item)
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, len(self._items))
+            self._condition.notify()
+            return True
+
+    def get(self):
+        # Blocks until an item is available, returns None once the queue is closed and drained
+        with self._condition:
+            while not self._items and not self._closed:
+                self._condition.wait()
+            if not self._items:
+                return None
+            self.dequeued += 1
+            return self._items.popleft()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def depth(self):
+        return len(self._items)
+
+    def stats(self):
+        return {
+            "depth": self.depth(),
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "dequeued": self.dequeued,
+            "dropped": self.dropped,
+        }
+
+
+class StageWorker(threading.Thread):
+    # Drains a FrameQueue on its own thread and hands every item to handler
+
+    def __init__(self, name, queue, handler):
+        super().__init__(name=name, daemon=True)
+        self.queue = queue
+        self.handler = handler
+        self.processed = 0
+        self.busy_seconds = 0.0
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            started = time.perf_counter()
+            try:
+                self.handler(item)
+            except Exception as e:
+                print(f"An error occurred in stage {self.name}: {e}", flush=True)
+            self.busy_seconds += time.perf_counter() - started
+            self.processed += 1
+
+    def stop(self, timeout=None):
+        self.queue.close()
+        self.join(timeout)
+
+    def stats(self):
+        stats = self.queue.stats()
+        stats["processed"] = self.processed
+        stats["busy_seconds"] = self.busy_seconds
+        return stats
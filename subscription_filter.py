@@ -0,0 +1,114 @@
+import math
+
+# Per-subscriber object filters for the subscription server. A subscriber names the object classes
+# it wants, a minimum likelihood and optionally geofenced regions as lat/lon boxes. Objects are put
+# in a uniform lat/lon grid once per published message, so a region only looks at the objects in the
+# cells it overlaps instead of every object, and subscribers with the same filter share one lookup.
+
+DEFAULT_CLASSES = ("Human",)
+GRID_CELL_DEGREES = 0.001  # About 110 m of latitude per cell
+MAX_REGIONS = 64
+
+
+class SubscriptionFilter:
+    # Immutable and hashable, subscribers with equal filters are served from one encoded message
+
+    __slots__ = ("classes", "min_likelihood", "regions", "_key")
+
+    def __init__(self, classes=DEFAULT_CLASSES, min_likelihood=0.0, regions=()):
+        self.classes = frozenset(classes)
+        self.min_likelihood = float(min_likelihood)
+        self.regions = tuple(regions)  # (min_lat, min_lon, max_lat, max_lon) per region
+        self._key = (self.classes, self.min_likelihood, self.regions)
+
+    @classmethod
+    def from_request(cls, request):
+        # Builds a filter from the "filter" object of a Subscription request, missing fields keep
+        # their defaults. Raises ValueError when the request is malformed.
+        if not isinstance(request, dict):
+            raise ValueError("filter must be an object")
+        classes = request.get("classes", DEFAULT_CLASSES)
+        if not isinstance(classes, (list, tuple)) or not classes or not all(isinstance(name, str) for name in classes):
+            raise ValueError("classes must be a non-empty list of class names")
+        min_likelihood = request.get("minLikelihood", 0.0)
+        if isinstance(min_likelihood, bool) or not isinstance(min_likelihood, (int, float)) or not 0.0 <= min_likelihood <= 1.0:
+            raise ValueError("minLikelihood must be a number between 0 and 1")
+        regions = request.get("regions", [])
+        if not isinstance(regions, list) or len(regions) > MAX_REGIONS:
+            raise ValueError(f"regions must be a list of at most {MAX_REGIONS} boxes")
+        boxes = []
+        for region in regions:
+            try:
+                box = tuple(float(region[key]) for key in ("minLat", "minLon", "maxLat", "maxLon"))
+            except (KeyError, TypeError, ValueError):
+                raise ValueError("each region needs numeric minLat, minLon, maxLat and maxLon") from None
+            if not (-90.0 <= box[0] <= box[2] <= 90.0 and -180.0 <= box[1] <= box[3] <= 180.0):
+                raise ValueError(f"region {region} is not a valid lat/lon box")
+            boxes.append(box)
+        return cls(classes, min_likelihood, boxes)
+
+    def describe(self):
+        # The filter in request form, echoed back in the Subscription response
+        description = {"classes": sorted(self.classes), "minLikelihood": self.min_likelihood}
+        if self.regions:
+            description["regions"] = [{"minLat": box[0], "minLon": box[1], "maxLat": box[2], "maxLon": box[3]}
+                                      for box in self.regions]
+        return description
+
+    def select(self, grid, classes, likelihoods):
+        # Indices of the objects this filter passes, in their original order
+        candidates = grid.query(self.regions) if self.regions else range(len(classes))
+        return [index for index in candidates
+                if classes[index] in self.classes and likelihoods[index] >= self.min_likelihood]
+
+    def __eq__(self, other):
+        return isinstance(other, SubscriptionFilter) and self._key == other._key
+
+    def __hash__(self):
+        return hash(self._key)
+
+
+DEFAULT_FILTER = SubscriptionFilter()
+
+
+class ObjectGrid:
+    # Uniform grid over the objects of one message: (lat cell, lon cell) -> object indices.
+    # Objects without a position are left out and can only match filters without regions.
+
+    def __init__(self, latitudes, longitudes, cell_degrees=GRID_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self.latitudes = []
+        self.longitudes = []
+        self.cells = {}
+        for index, (latitude, longitude) in enumerate(zip(latitudes, longitudes)):
+            try:
+                latitude = float(latitude)
+                longitude = float(longitude)
+            except (TypeError, ValueError):
+                latitude = longitude = math.nan
+            self.latitudes.append(latitude)
+            self.longitudes.append(longitude)
+            if latitude == latitude and longitude == longitude:  # Not NaN
+                cell = (math.floor(latitude / cell_degrees), math.floor(longitude / cell_degrees))
+                self.cells.setdefault(cell, []).append(index)
+
+    def query(self, regions):
+        # Sorted indices of the objects inside any of the (min_lat, min_lon, max_lat, max_lon) boxes
+        found = set()
+        for min_lat, min_lon, max_lat, max_lon in regions:
+            first_row, last_row = math.floor(min_lat / self.cell_degrees), math.floor(max_lat / self.cell_degrees)
+            first_column, last_column = math.floor(min_lon / self.cell_degrees), math.floor(max_lon / self.cell_degrees)
+            if (last_row - first_row + 1) * (last_column - first_column + 1) <= len(self.cells):
+                cells = [self.cells.get((row, column)) for row in range(first_row, last_row + 1)
+                         for column in range(first_column, last_column + 1)]
+            else:
+                # A box larger than the occupied area, walk the occupied cells instead
+                cells = [indices for (row, column), indices in self.cells.items()
+                         if first_row <= row <= last_row and first_column <= column <= last_column]
+            for indices in cells:
+                if indices is None:
+                    continue
+                for index in indices:
+                    if min_lat <= self.latitudes[index] <= max_lat and min_lon <= self.longitudes[index] <= max_lon:
+                        found.add(index)
+        return sorted(found)
@@ -0,0 +1,142 @@
+import asyncio
+import codecs
+import json
+from subscription_filter import DEFAULT_FILTER, SubscriptionFilter
+
+# Initial response expected by v2x upon client connection
+SUBSCRIPTION_RESPONSE = {
+    "messageType": "Subscription",
+    "subscription": {
+        "returnValue": "OK",
+        "type": "Data"
+    }
+}
+MAX_CLIENT_BUFFER = 256 * 1024
+MAX_REQUEST_SIZE = 64 * 1024
+
+
+class SubscriptionServer:
+    # asyncio TCP server for any number of V2X subscribers. Messages are produced on the GStreamer
+    # threads, copied once and written to every client from the event loop. A client whose unsent
+    # backlog grows past max_client_buffer bytes is disconnected instead of slowing the others down.
+    #
+    # Every client gets SUBSCRIPTION_RESPONSE on connect and DEFAULT_FILTER, every Human object. It may
+    # then send JSON Subscription requests to choose what it receives, e.g.
+    #   {"messageType": "Subscription", "filter": {"classes": ["Human"], "minLikelihood": 0.6,
+    #    "regions": [{"minLat": 40.0, "minLon": -83.01, "maxLat": 40.001, "maxLon": -83.0}]}}
+    # Each request replaces the client's filter and is acknowledged with a response echoing it; the
+    # messages after the acknowledgement follow the new filter.
+
+    def __init__(self, host, port, max_client_buffer=MAX_CLIENT_BUFFER):
+        self.host = host
+        self.port = port
+        self.max_client_buffer = max_client_buffer
+        self.sent_messages = 0
+        self.evicted_clients = 0
+        self._clients = {}  # writer -> SubscriptionFilter
+        self._handlers = set()
+        self._loop = None
+        self._stopped = None
+
+    def stats(self):
+        return {
+            "subscribers": len(self._clients),
+            "filter_groups": len(set(self._clients.values())),
+            "sent_messages": self.sent_messages,
+            "evicted_clients": self.evicted_clients,
+        }
+
+    async def serve_forever(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        print(f"Socket server running at {self.host}:{self.port}", flush=True)
+        async with server:
+            await self._stopped.wait()
+        for writer in list(self._clients):
+            writer.close()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+
+    def stop(self):
+        # Safe to call from any thread
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+
+    def subscriber_groups(self):
+        # Safe to call from any thread: SubscriptionFilter -> the clients that registered it
+        groups = {}
+        for writer, subscription_filter in list(self._clients.items()):
+            groups.setdefault(subscription_filter, []).append(writer)
+        return groups
+
+    def send(self, writers, message):
+        # Safe to call from any thread, writers as returned by subscriber_groups()
+        if self._loop is None or not writers:
+            return
+        self._loop.call_soon_threadsafe(self._fan_out, bytes(message), writers)
+
+    def _subscribe(self, writer, request):
+        # Applies one Subscription request, raises ValueError when it is malformed
+        if not isinstance(request, dict):
+            raise ValueError("Subscription request must be a JSON object")
+        subscription_filter = SubscriptionFilter.from_request(request.get("filter", {}))
+        if writer.is_closing():
+            return  # Evicted while the request was read
+        response = {"messageType": "Subscription", "subscription": dict(SUBSCRIPTION_RESPONSE["subscription"], filter=subscription_filter.describe())}
+        writer.write(json.dumps(response).encode())
+        self._clients[writer] = subscription_filter
+
+    async def _handle_client(self, reader, writer):
+        addr = writer.get_extra_info("peername")
+        print("Client connected:", addr, flush=True)
+        self._handlers.add(asyncio.current_task())
+        decoder = json.JSONDecoder()
+        text_decoder = codecs.getincrementaldecoder("utf-8")()
+        pending = ""  # Received request text not decoded yet, requests may arrive in pieces
+        try:
+            writer.write(json.dumps(SUBSCRIPTION_RESPONSE).encode())
+            await writer.drain()
+            self._clients[writer] = DEFAULT_FILTER
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                try:
+                    pending += text_decoder.decode(data)
+                    while pending.strip():
+                        try:
+                            request, end = decoder.raw_decode(pending.lstrip())
+                        except ValueError:
+                            if len(pending) > MAX_REQUEST_SIZE:
+                                raise ValueError("Subscription request is not valid JSON") from None
+                            break  # Wait for the rest of the request
+                        pending = pending.lstrip()[end:]
+                        self._subscribe(writer, request)
+                except ValueError as e:
+                    # Tell the client why and hang up rather than stream data it did not ask for
+                    self._clients.pop(writer, None)
+                    response = {"messageType": "Subscription", "subscription": {"returnValue": "Error", "type": "Data", "reason": str(e)}}
+                    writer.write(json.dumps(response).encode())
+                    await writer.drain()
+                    print(f"Rejected subscription from {addr}: {e}", flush=True)
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self._handlers.discard(asyncio.current_task())
+            self._clients.pop(writer, None)
+            writer.close()
+            print("Client disconnected:", addr, flush=True)
+
+    def _fan_out(self, message, writers):
+        for writer in writers:
+            if writer not in self._clients or writer.is_closing():
+                continue
+            if writer.transport.get_write_buffer_size() + len(message) > self.max_client_buffer:
+                print("Evicting slow client:", writer.get_extra_info("peername"), flush=True)
+                self.evicted_clients += 1
+                self._clients.pop(writer, None)
+                writer.transport.abort()
+                continue
+            writer.write(message)
+        self.sent_messages += 1
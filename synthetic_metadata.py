@@ -0,0 +1,133 @@
+import random
+from datetime import datetime, timedelta, timezone
+from rtp import RTP_HEADER
+
+# Generates ONVIF tt:MetadataStream documents shaped like the camera output, for benchmarks and replays
+
+ENTERING_TOPIC = "tns1:IVA/EnteringField/Entering_field"
+LEAVING_TOPIC = "tns1:IVA/LeavingField/Leaving_field"
+RTP_PAYLOAD_SIZE = 1400  # Payload bytes per RTP packet, keeps packets under a 1500 byte MTU
+RTP_PAYLOAD_TYPE = 107
+RTP_CLOCK_RATE = 90000
+
+_STREAM_OPEN = ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<tt:MetadataStream xmlns:tt="http://www.onvif.org/ver10/schema" '
+                'xmlns:wsnt="http://docs.oasis-open.org/wsn/b-2" '
+                'xmlns:tns1="http://www.onvif.org/ver10/topics">')
+_STREAM_CLOSE = '</tt:MetadataStream>'
+
+
+def format_utc_time(moment):
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.") + f"{moment.microsecond // 1000:03d}Z"
+
+
+def _object_xml(object_id, state):
+    return (f'<tt:Object ObjectId="{object_id}"><tt:Appearance>'
+            f'<tt:Shape><tt:BoundingBox left="{state["x"] - 0.05:.4f}" top="{state["y"] + 0.1:.4f}" '
+            f'right="{state["x"] + 0.05:.4f}" bottom="{state["y"] - 0.1:.4f}"/>'
+            f'<tt:CenterOfGravity x="{state["x"]:.4f}" y="{state["y"]:.4f}"/></tt:Shape>'
+            f'<tt:Class><tt:ClassCandidate><tt:Type>{state["class"]}</tt:Type>'
+            f'<tt:Likelihood>{state["likelihood"]:.2f}</tt:Likelihood></tt:ClassCandidate></tt:Class>'
+            f'<tt:GeoLocation lat="{state["lat"]:.7f}" lon="{state["lon"]:.7f}" elevation="{state["elevation"]:.1f}"/>'
+            f'<tt:Speed>{state["speed"]:.2f}</tt:Speed>'
+            f'</tt:Appearance></tt:Object>')
+
+
+def _notification_xml(topic, object_ids, utc_time):
+    items = "".join(f'<tt:SimpleItem Name="ObjectId" Value="{object_id}"/>' for object_id in object_ids)
+    return (f'<wsnt:NotificationMessage><wsnt:Topic Dialect="http://www.onvif.org/ver10/tev/topicExpression/ConcreteSet">'
+            f'{topic}</wsnt:Topic><wsnt:Message><tt:Message UtcTime="{utc_time}" PropertyOperation="Changed">'
+            f'<tt:Source><tt:SimpleItem Name="VideoSourceConfigurationToken" Value="video_0"/></tt:Source>'
+            f'<tt:Key>{items}</tt:Key><tt:Data><tt:SimpleItem Name="IsInside" Value="true"/></tt:Data>'
+            f'</tt:Message></wsnt:Message></wsnt:NotificationMessage>')
+
+
+def make_metadata_stream(objects, utc_time, entering=(), leaving=()):
+    # objects: ObjectId -> state dict as produced by SceneGenerator
+    parts = [_STREAM_OPEN, '<tt:VideoAnalytics>', f'<tt:Frame UtcTime="{utc_time}">']
+    parts.extend(_object_xml(object_id, state) for object_id, state in objects.items())
+    parts.append('</tt:Frame></tt:VideoAnalytics>')
+    if entering or leaving:
+        parts.append('<tt:Event>')
+        if entering:
+            parts.append(_notification_xml(ENTERING_TOPIC, entering, utc_time))
+        if leaving:
+            parts.append(_notification_xml(LEAVING_TOPIC, leaving, utc_time))
+        parts.append('</tt:Event>')
+    parts.append(_STREAM_CLOSE)
+    return "".join(parts).encode()
+
+
+class SceneGenerator:
+    # A scene with a steady number of moving objects. Every frame a few objects leave and are
+    # replaced by new ones, so Entering/Leaving notifications keep flowing.
+
+    def __init__(self, object_count, human_ratio=0.7, churn=0.02, fps=10, seed=1):
+        self.random = random.Random(seed)
+        self.object_count = object_count
+        self.human_ratio = human_ratio
+        self.churn = churn
+        self.frame_interval = timedelta(seconds=1 / fps)
+        self.moment = datetime(2024, 3, 1, 12, 0, 0, tzinfo=timezone.utc)
+        self.next_object_id = 1
+        self.objects = {}
+        self.pending_entering = []
+        for _ in range(object_count):
+            self._spawn()
+
+    def _spawn(self):
+        object_id = str(self.next_object_id)
+        self.next_object_id += 1
+        self.objects[object_id] = {
+            "x": self.random.uniform(-0.9, 0.9),
+            "y": self.random.uniform(-0.9, 0.9),
+            "class": "Human" if self.random.random() < self.human_ratio else "Vehicle",
+            "likelihood": self.random.uniform(0.5, 1.0),
+            "lat": 40.0 + self.random.uniform(0, 0.001),
+            "lon": -83.0 + self.random.uniform(0, 0.001),
+            "elevation": self.random.uniform(200, 220),
+            "speed": self.random.uniform(0, 2),
+        }
+        self.pending_entering.append(object_id)
+
+    def next_frame(self):
+        # Returns one complete MetadataStream document as bytes
+        leaving = []
+        for object_id in list(self.objects):
+            if self.random.random() < self.churn:
+                leaving.append(object_id)
+                del self.objects[object_id]
+        for _ in leaving:
+            self._spawn()
+        for state in self.objects.values():
+            state["x"] += self.random.uniform(-0.01, 0.01)
+            state["y"] += self.random.uniform(-0.01, 0.01)
+            state["lat"] += self.random.uniform(-2e-6, 2e-6)
+            state["lon"] += self.random.uniform(-2e-6, 2e-6)
+
+        entering, self.pending_entering = self.pending_entering, []
+        document = make_metadata_stream(self.objects, format_utc_time(self.moment), entering, leaving)
+        self.moment += self.frame_interval
+        return document
+
+
+def packetize(document, sequence_number, timestamp, payload_size=RTP_PAYLOAD_SIZE, ssrc=0x1234):
+    # Splits a document into RTP packets, the marker bit is set on the last one
+    packets = []
+    for offset in range(0, len(document), payload_size):
+        last = offset + payload_size >= len(document)
+        header = RTP_HEADER.pack(0x80, (0x80 if last else 0) | RTP_PAYLOAD_TYPE,
+                                 sequence_number & 0xFFFF, timestamp & 0xFFFFFFFF, ssrc)
+        packets.append(header + document[offset:offset + payload_size])
+        sequence_number += 1
+    return packets
+
+
+def generate_packets(object_count, frame_count, fps=10, seed=1):
+    # Yields the RTP packets of frame_count consecutive frames
+    scene = SceneGenerator(object_count, fps=fps, seed=seed)
+    sequence_number = 0
+    for frame_index in range(frame_count):
+        packets = packetize(scene.next_frame(), sequence_number, frame_index * RTP_CLOCK_RATE // fps)
+        sequence_number += len(packets)
+        yield from packets
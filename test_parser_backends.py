@@ -0,0 +1,132 @@
+import unittest
+import xml.etree.ElementTree as ET
+from parser_backends import ElementTreeBackend, available_backends, create_backend
+from synthetic_metadata import SceneGenerator
+from utc_time import parse_utc_time_ms
+
+# Every backend must return what ElementTreeBackend returns, or raise ET.ParseError where it does
+
+HEADER = ('<tt:MetadataStream xmlns:tt="http://www.onvif.org/ver10/schema" '
+          'xmlns:wsnt="http://docs.oasis-open.org/wsn/b-2">')
+FOOTER = "</tt:MetadataStream>"
+
+
+def _object(object_id, body="", tag="tt:Object"):
+    return f'<{tag} ObjectId="{object_id}"><tt:Appearance>{body}</tt:Appearance></{tag}>'
+
+
+def _frame(*objects, utc_time="2024-05-01T12:00:00.123Z"):
+    utc_attribute = f' UtcTime="{utc_time}"' if utc_time is not None else ""
+    return f"<tt:VideoAnalytics><tt:Frame{utc_attribute}>{''.join(objects)}</tt:Frame></tt:VideoAnalytics>"
+
+
+def _notification(topic, object_ids, body=""):
+    items = "".join(f'<tt:SimpleItem Name="ObjectId" Value="{object_id}"/>' for object_id in object_ids)
+    return (f"<tt:Event><wsnt:NotificationMessage><wsnt:Topic>{topic}</wsnt:Topic>"
+            f"<wsnt:Message><tt:Message><tt:Key>{items}</tt:Key></tt:Message></wsnt:Message>{body}"
+            f"</wsnt:NotificationMessage></tt:Event>")
+
+
+GEO = '<tt:Shape><tt:CenterOfGravity x="0.1" y="-0.2"/></tt:Shape><tt:GeoLocation lat="40.1" lon="-83.2" elevation="250"/>'
+CLASS = "<tt:Class><tt:ClassCandidate><tt:Type>Human</tt:Type><tt:Likelihood>0.9</tt:Likelihood></tt:ClassCandidate></tt:Class>"
+SPEED = "<tt:Speed>1.50</tt:Speed>"
+
+DOCUMENTS = {
+    "plain objects": _frame(_object(1, GEO + CLASS + SPEED), _object(2, CLASS)),
+    "no frame": _object(1, GEO),
+    "frame without UtcTime": _frame(_object(1, GEO), utc_time=None) + _frame(_object(2, GEO)),
+    "empty frame": _frame(),
+    "UtcTime with offset": _frame(_object(1, GEO), utc_time="2024-05-01T14:00:00.5+02:00"),
+    "notifications": _notification("tns1:RuleEngine/FieldDetector/ObjectsInside", [1, 2])
+                     + _notification("tns1:VideoAnalytics/LeavingField", [3]),
+    "notification without key": _notification("tns1:RuleEngine/Entering", []).replace("<tt:Key></tt:Key>", ""),
+    "empty topic": _notification("", [1]),
+    "object inside notification": _notification("tns1:Entering", [7], _object(7, GEO + CLASS)),
+    "notification inside object": _frame(_object(1, GEO + _notification("tns1:Leaving", [1]))),
+    "geolocation outside object": _frame(_object(1, CLASS)) + GEO + SPEED + CLASS,
+    "object without fields": _frame(_object(1), _object(2, GEO)),
+    "repeated ObjectId": _frame(_object(1, GEO + SPEED), _object(1, CLASS.replace("Human", "Vehicle"))),
+    "repeated fields": _frame(_object(1, GEO + GEO.replace("40.1", "41.0") + SPEED + SPEED.replace("1.50", "9")
+                                      + CLASS + CLASS.replace("Human", "Vehicle"))),
+    "extra class candidates": _frame(_object(1, "<tt:Class>"
+                                               "<tt:ClassCandidate><tt:Type>Vehicle</tt:Type><tt:Likelihood>0.4</tt:Likelihood></tt:ClassCandidate>"
+                                               "<tt:ClassCandidate><tt:Type>Human</tt:Type><tt:Likelihood>0.6</tt:Likelihood></tt:ClassCandidate>"
+                                               "</tt:Class>")),
+    "type outside class candidate": _frame(_object(1, "<tt:Type>Animal</tt:Type>" + CLASS + "<tt:Type>Vehicle</tt:Type>")),
+    "nested objects": _frame(_object(1, CLASS + _object(2, GEO + SPEED))),
+    "whitespace text": _frame(_object(1, "<tt:Speed>\n  1.50 \n</tt:Speed><tt:Class><tt:ClassCandidate>"
+                                         "<tt:Type> Human</tt:Type><tt:Likelihood>\t0.9\n</tt:Likelihood>"
+                                         "</tt:ClassCandidate></tt:Class>")),
+    "empty text": _frame(_object(1, "<tt:Speed></tt:Speed><tt:Class><tt:ClassCandidate><tt:Type/>"
+                                    "<tt:Likelihood></tt:Likelihood></tt:ClassCandidate></tt:Class>")),
+    "text with children": _frame(_object(1, "<tt:Speed>2.5<tt:Extension>ignored</tt:Extension>more</tt:Speed>")),
+    "entities and CDATA": _frame(_object(1, "<tt:Speed>&#49;.5</tt:Speed><tt:Class><tt:ClassCandidate>"
+                                            "<tt:Type><![CDATA[Human]]></tt:Type><tt:Likelihood>0.&#57;</tt:Likelihood>"
+                                            "</tt:ClassCandidate></tt:Class>")),
+    "comments in text": _frame(_object(1, "<tt:Speed>1.<!-- tenths -->5</tt:Speed><!-- <tt:Speed>3</tt:Speed> -->")),
+    "key outside message": _notification("tns1:Entering", [1]).replace("<tt:Message>", "<tt:Other>").replace("</tt:Message>", "</tt:Other>"),
+    "objects as key items": _notification("tns1:Entering", []).replace("<tt:Key></tt:Key>", "<tt:Key>" + _object(4, GEO) + "</tt:Key>"),
+    "object without ObjectId": _frame(_object(1, GEO).replace(' ObjectId="1"', "")),
+}
+MALFORMED = {
+    "truncated": (HEADER + _frame(_object(1, GEO)))[:-20],
+    "mismatched tag": HEADER + "<tt:Frame></tt:Object>" + FOOTER,
+    "undeclared prefix": HEADER + "<xx:Frame/>" + FOOTER,
+    "empty document": "",
+    "text after root": HEADER + FOOTER + "<tt:Frame/>",
+    "notification without topic": HEADER + _notification("tns1:Entering", [1]).replace(
+        "<wsnt:Topic>tns1:Entering</wsnt:Topic>", "") + FOOTER,
+    "class candidate without type": HEADER + _frame(_object(1, "<tt:Class><tt:ClassCandidate><tt:Likelihood>0.4</tt:Likelihood>"
+                                                               "</tt:ClassCandidate></tt:Class><tt:Type>Human</tt:Type>")) + FOOTER,
+}
+
+
+def _parse(backend, document):
+    try:
+        return backend.parse(document.encode())
+    except ET.ParseError:
+        return ET.ParseError
+
+
+class ParserBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.reference = ElementTreeBackend()
+        self.backends = [create_backend(name) for name in available_backends()]
+
+    def assertBackendsAgree(self, document):
+        expected = _parse(self.reference, document)
+        for backend in self.backends:
+            with self.subTest(backend=backend.name):
+                self.assertEqual(_parse(backend, document), expected)
+        return expected
+
+    def test_edge_cases(self):
+        for name, body in DOCUMENTS.items():
+            with self.subTest(document=name):
+                self.assertIsNot(self.assertBackendsAgree(HEADER + body + FOOTER), ET.ParseError)
+
+    def test_malformed_documents_raise_parse_error(self):
+        for name, document in MALFORMED.items():
+            with self.subTest(document=name):
+                self.assertIs(self.assertBackendsAgree(document), ET.ParseError)
+
+    def test_synthetic_scenes(self):
+        generator = SceneGenerator(50, seed=3)
+        for _ in range(20):
+            self.assertBackendsAgree(generator.next_frame().decode())
+
+    def test_utc_time_reaches_the_codec_intact(self):
+        # The stored value is the raw attribute, whatever its suffix
+        for utc_time in ("2024-05-01T12:00:00.500Z", "2024-05-01T14:00:00.5+02:00", "2024-05-01T12:00:00.5"):
+            for backend in [self.reference] + self.backends:
+                with self.subTest(utc_time=utc_time, backend=backend.name):
+                    _, objects_by_id = backend.parse((HEADER + _frame(_object(1, GEO), utc_time=utc_time) + FOOTER).encode())
+                    self.assertEqual(parse_utc_time_ms(objects_by_id["1"]["utc_time"]), 1714564800500)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            create_backend("sax")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+from rtp import MAX_MISORDER, RTP_HEADER, FrameReassembler, parse_rtp_header
+
+# Packets are (sequence_number, timestamp, marker, payload), every frame ends with a marker bit
+
+SSRC = 0x1234ABCD
+
+
+def _frame(first_sequence, timestamp, *payloads):
+    return [((first_sequence + index) & 0xFFFF, timestamp, index == len(payloads) - 1, payload)
+            for index, payload in enumerate(payloads)]
+
+
+def _push(reassembler, packets, ssrc=SSRC):
+    frames = []
+    for sequence_number, timestamp, marker, payload in packets:
+        frame = reassembler.push(sequence_number, timestamp, marker, payload, ssrc)
+        if frame is not None:
+            frames.append(frame)
+    return frames
+
+
+class FrameReassemblerTest(unittest.TestCase):
+    def setUp(self):
+        self.reassembler = FrameReassembler()
+        _push(self.reassembler, _frame(65000, 0, b"tail"))  # Joined mid-stream, synchronized on this marker
+
+    def test_frames_across_wraparound(self):
+        frames = _push(self.reassembler, _frame(65001, 100, b"<a>", b"</a>") + _frame(65003, 200, *[b"x"] * 600))
+        self.assertEqual(frames, [b"<a></a>", b"x" * 600])
+        self.assertEqual(self.reassembler.stats()["lost_packets"], 0)
+
+    def test_loss_drops_only_the_damaged_frame(self):
+        packets = _frame(65001, 100, b"a", b"b", b"c") + _frame(65004, 200, b"d", b"e")
+        del packets[1]
+        self.assertEqual(_push(self.reassembler, packets), [b"de"])
+        stats = self.reassembler.stats()
+        self.assertEqual((stats["lost_packets"], stats["dropped_frames"]), (1, 1))
+
+    def test_gap_before_a_frame_head(self):
+        packets = _frame(65001, 100, b"a", b"b") + _frame(65003, 200, b"c", b"d") + _frame(65005, 300, b"e")
+        del packets[2]  # Head of the second frame
+        self.assertEqual(_push(self.reassembler, packets), [b"ab", b"e"])
+
+    def test_late_packets_are_ignored(self):
+        packets = _frame(65001, 100, b"a", b"b")
+        frames = _push(self.reassembler, packets + packets[:1] + [(65003 - MAX_MISORDER, 50, True, b"old")]
+                       + _frame(65003, 200, b"c"))
+        self.assertEqual(frames, [b"ab", b"c"])
+        stats = self.reassembler.stats()
+        self.assertEqual((stats["late_packets"], stats["sequence_resets"]), (2, 0))
+
+    def test_backward_jump_resyncs(self):
+        # A restarted sender numbers from somewhere behind, which must not be taken as late forever
+        frames = _push(self.reassembler, _frame(65001 - MAX_MISORDER - 10, 900, b"a")
+                       + _frame(65001 - MAX_MISORDER - 9, 1000, b"b", b"c"))
+        self.assertEqual(frames, [b"bc"])  # The first packet after the jump may be mid-frame
+        stats = self.reassembler.stats()
+        self.assertEqual((stats["sequence_resets"], stats["late_packets"], stats["lost_packets"]), (1, 0, 0))
+
+    def test_ssrc_change_resyncs(self):
+        frames = _push(self.reassembler, _frame(65001, 100, b"a", b"b")[:1])
+        frames += _push(self.reassembler, _frame(65001, 100, b"a") + _frame(65002, 200, b"b"), ssrc=SSRC + 1)
+        self.assertEqual(frames, [b"b"])  # The partial frame of the old sender is never completed
+        stats = self.reassembler.stats()
+        self.assertEqual((stats["sequence_resets"], stats["late_packets"]), (1, 0))
+
+    def test_parse_rtp_header(self):
+        packet = RTP_HEADER.pack(0x80, 0x80 | 107, 42, 90000, SSRC) + b"<tt:MetadataStream/>"
+        self.assertEqual(parse_rtp_header(packet), (42, 90000, True, SSRC, RTP_HEADER.size, len(packet)))
+
+
+if __name__ == "__main__":
+    unittest.main()
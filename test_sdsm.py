@@ -0,0 +1,79 @@
+import struct
+import unittest
+from unittest import mock
+import geo
+import sdsm
+from sdsm import OBJECT_TYPE_HUMAN, SdsmEncoder
+
+# The NumPy batch path must pack the same bytes as the scalar fallback, and raise where it raises
+
+COLUMNS = (
+    [1, 2, 3],  # object ids
+    [1714564800123, 1714564800223, 1714564800323],  # times ms
+    ["40.0012345", "-33.8688197", 51.5],  # latitudes
+    ["-83.0009876", "151.2092955", -0.1275],  # longitudes
+    ["250.5", "-12", 0],  # elevations
+    ["1.50", "0", 13.37],  # speeds
+    [0, 14399, 28799],  # headings
+)
+
+
+def _pack(columns, max_objects=sdsm.MAX_OBJECTS):
+    object_ids, times_ms, latitudes, longitudes, elevations, speeds, headings = columns
+    encoder = SdsmEncoder(max_objects)
+    packed = encoder.add_objects(object_ids, OBJECT_TYPE_HUMAN, times_ms, latitudes, longitudes,
+                                 elevations, speeds, headings)
+    return packed, encoder.finish().tobytes()
+
+
+def _both_paths(function, *args):
+    # (NumPy result, scalar result), an exception type stands in for a result
+    results = []
+    for numpy_module in (sdsm.np, None):
+        with mock.patch.object(sdsm, "np", numpy_module), mock.patch.object(geo, "np", numpy_module):
+            try:
+                results.append(function(*args))
+            except (TypeError, ValueError, OverflowError, struct.error):
+                results.append(Exception)
+    return results
+
+
+@unittest.skipIf(sdsm.np is None, "NumPy is not installed")
+class SdsmPathsTest(unittest.TestCase):
+    def assertPathsAgree(self, function, *args):
+        numpy_result, scalar_result = _both_paths(function, *args)
+        self.assertEqual(numpy_result, scalar_result)
+        return numpy_result
+
+    def test_pack(self):
+        packed, message = self.assertPathsAgree(_pack, COLUMNS)
+        self.assertEqual(packed, 3)
+        self.assertEqual(len(message), sdsm.HEADER.size + 3 * sdsm.OBJECT_RECORD.size)
+
+    def test_overflow(self):
+        packed, _ = self.assertPathsAgree(_pack, COLUMNS, 2)
+        self.assertEqual(packed, 2)
+
+    def test_missing_or_invalid_fields_raise(self):
+        for column_index in (2, 3, 4, 5, 6):  # latitude, longitude, elevation, speed, heading
+            for bad_value in (None, "nan", float("inf"), "1e12"):
+                columns = [list(column) for column in COLUMNS]
+                columns[column_index][1] = bad_value
+                with self.subTest(column=column_index, value=bad_value):
+                    self.assertIs(self.assertPathsAgree(_pack, columns), Exception)
+
+    def test_heading_units(self):
+        self.assertPathsAgree(geo.heading_units, [0, 45.5, "90", -10.01, 359.9875])
+        for bad_value in (None, "nan"):
+            with self.subTest(value=bad_value):
+                self.assertIs(self.assertPathsAgree(geo.heading_units, [10, bad_value]), Exception)
+
+    def test_calculate_bearings(self):
+        self.assertPathsAgree(geo.calculate_bearings, [40.0, 40.0], [-83.0, -83.0], [40.001, 39.999], [-83.0, -82.999])
+        with mock.patch("builtins.print"):  # calculate_bearing reports the bad position
+            bearings = self.assertPathsAgree(geo.calculate_bearings, [40.0, None], [-83.0, -83.0], [40.001, 40.0], [-83.0, -83.0])
+        self.assertIsNone(bearings[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
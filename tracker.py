@@ -0,0 +1,95 @@
+import time
+
+DEFAULT_TTL = 10.0  # Seconds an object may go unseen before it is assumed to have left
+DEFAULT_MAX_OBJECTS = 1024
+EXPIRY_CHECK_INTERVAL = 1.0  # Seconds between scans for expired objects
+
+
+class TrackedObject:
+    # Per-object state kept between frames, coordinates are stored already parsed to float
+    __slots__ = ("object_id", "x", "y", "lat", "lon", "utc_time", "class_candidate_type", "last_seen")
+
+    def __init__(self, object_id, last_seen):
+        self.object_id = object_id
+        self.x = None
+        self.y = None
+        self.lat = None
+        self.lon = None
+        self.utc_time = None
+        self.class_candidate_type = None
+        self.last_seen = last_seen  # time.monotonic() of the last frame the object appeared in
+
+
+class ObjectTracker:
+    # ObjectId -> TrackedObject, insert and remove are O(1) and entering an id twice is a no-op.
+    # Objects whose LeavingField notification was lost are evicted once they have not been seen for
+    # ttl seconds, and the number of tracked objects never exceeds max_objects.
+
+    def __init__(self, ttl=DEFAULT_TTL, max_objects=DEFAULT_MAX_OBJECTS):
+        self.ttl = ttl
+        self.max_objects = max_objects
+        self.expired_objects = 0
+        self.capped_objects = 0
+        self._objects = {}
+        self._next_expiry_check = 0.0
+
+    def add(self, object_id, now=None):
+        tracked = self._objects.get(object_id)
+        if tracked is None:
+            if now is None:
+                now = time.monotonic()
+            if len(self._objects) >= self.max_objects:
+                # Make room by dropping the object that has gone unseen the longest
+                oldest = min(self._objects.values(), key=lambda candidate: candidate.last_seen)
+                del self._objects[oldest.object_id]
+                self.capped_objects += 1
+            tracked = self._objects[object_id] = TrackedObject(object_id, now)
+        return tracked
+
+    def remove(self, object_id):
+        return self._objects.pop(object_id, None)
+
+    def resume(self, outage):
+        # The stream was down for outage seconds, which must not count against the ttl of objects
+        # that could not be seen in the meantime
+        for tracked in list(self._objects.values()):
+            tracked.last_seen += outage
+
+    def clear(self):
+        self._objects.clear()
+
+    def expire(self, now=None):
+        # Evicts objects not seen for ttl seconds, scanning at most once per EXPIRY_CHECK_INTERVAL.
+        # Returns the number of evicted objects.
+        if now is None:
+            now = time.monotonic()
+        if now < self._next_expiry_check:
+            return 0
+        self._next_expiry_check = now + min(EXPIRY_CHECK_INTERVAL, self.ttl)
+        expired = [object_id for object_id, tracked in self._objects.items() if now - tracked.last_seen > self.ttl]
+        for object_id in expired:
+            del self._objects[object_id]
+        self.expired_objects += len(expired)
+        return len(expired)
+
+    def get(self, object_id):
+        return self._objects.get(object_id)
+
+    def items(self):
+        return self._objects.items()
+
+    def stats(self):
+        return {
+            "tracked_objects": len(self._objects),
+            "expired_objects": self.expired_objects,
+            "capped_objects": self.capped_objects,
+        }
+
+    def __contains__(self, object_id):
+        return object_id in self._objects
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __iter__(self):
+        return iter(self._objects)
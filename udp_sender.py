@@ -0,0 +1,86 @@
+import socket
+import struct
+
+try:
+    import fcntl
+    import termios
+except ImportError:  # Not available on Windows, queued_bytes() then reports None
+    fcntl = None
+    termios = None
+
+
+def parse_destinations(value):
+    # "host:port,host:port" -> [("host", port), ...]
+    destinations = []
+    for entry in value.split(","):
+        entry = entry.strip()
+        if entry:
+            host, _, port = entry.rpartition(":")
+            destinations.append((host.strip("[]"), int(port)))
+    return destinations
+
+
+class UdpSender:
+    # Owns one long-lived, non-blocking UDP socket per address family and sends each datagram to
+    # every configured destination. Addresses are resolved once up front instead of on every send.
+
+    def __init__(self, destinations):
+        self.destinations = list(destinations)
+        self.sent_datagrams = 0
+        self.sent_bytes = 0
+        self.send_errors = 0
+        self.dropped_datagrams = 0  # Send buffer full, the datagram was not queued
+        self.last_error = None
+        self._sockets = {}
+        self._targets = []
+        for host, port in self.destinations:
+            family, _type, _proto, _name, address = socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM)[0]
+            sock = self._sockets.get(family)
+            if sock is None:
+                sock = self._sockets[family] = socket.socket(family, socket.SOCK_DGRAM)
+                sock.setblocking(False)
+            self._targets.append((sock, address))
+
+    def send(self, data):
+        # Returns the number of destinations the datagram was handed to
+        delivered = 0
+        for sock, address in self._targets:
+            try:
+                sock.sendto(data, address)
+            except BlockingIOError:
+                self.dropped_datagrams += 1
+                continue
+            except OSError as e:
+                self.send_errors += 1
+                if self.last_error is None or str(e) != str(self.last_error):
+                    print(f"An error occurred while sending to {address}: {e}", flush=True)
+                self.last_error = e
+                continue
+            delivered += 1
+            self.sent_datagrams += 1
+            self.sent_bytes += len(data)
+        return delivered
+
+    def queued_bytes(self):
+        # Bytes still waiting in the kernel send queues (Linux only)
+        if fcntl is None:
+            return None
+        queued = 0
+        for sock in self._sockets.values():
+            queued += struct.unpack("i", fcntl.ioctl(sock.fileno(), termios.TIOCOUTQ, b"\0\0\0\0"))[0]  # Native int
+        return queued
+
+    def stats(self):
+        return {
+            "sent_datagrams": self.sent_datagrams,
+            "sent_bytes": self.sent_bytes,
+            "send_errors": self.send_errors,
+            "dropped_datagrams": self.dropped_datagrams,
+            "queued_bytes": self.queued_bytes(),
+        }
+
+    def close(self):
+        for sock in self._sockets.values():
+            sock.close()
+        self._sockets.clear()
+        self._targets = []
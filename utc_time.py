@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta, timezone
+
+# ONVIF UtcTime values look like 2024-03-01T12:00:00.100Z. Every object of a tt:Frame carries the
+# same value, so the codec parses each distinct string once and serves the rest from a small cache.
+
+CACHE_SIZE = 64
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_UTC = _EPOCH.replace(tzinfo=timezone.utc)
+_MILLISECOND = timedelta(milliseconds=1)
+
+
+def parse_utc_time_ms(text):
+    # Epoch milliseconds of a UtcTime string in the YYYY-MM-DDTHH:MM:SS[.fff][Z|+HH:MM|-HH:MM]
+    # layout, read as UTC unless it carries an offset. The seconds part (and the offset) go through the
+    # C fromisoformat and the fraction is sliced off, so any number of fraction digits works on
+    # Python 3.9 too, whose fromisoformat only takes 3 or 6. Other layouts raise ValueError.
+    tail = text[19:].rstrip("Zz")
+    if not tail:
+        milliseconds = 0
+    elif tail[0] == "." and tail[1:].isdigit():
+        milliseconds = int(tail[1:4].ljust(3, "0"))
+    else:
+        # Explicit UTC offset, after the fraction if there is one
+        offset_start = 1 if tail[0] == "." else 0
+        while offset_start < len(tail) and tail[offset_start].isdigit():
+            offset_start += 1
+        fraction = tail[1:offset_start]
+        moment = datetime.fromisoformat(text[:19] + tail[offset_start:])
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        return (moment - _EPOCH_UTC) // _MILLISECOND + int(fraction[:3].ljust(3, "0"))
+    return (datetime.fromisoformat(text[:19]) - _EPOCH) // _MILLISECOND + milliseconds
+
+
+class UtcTimeCodec:
+    # parse_utc_time_ms with a cache of the most recent distinct strings
+
+    def __init__(self, cache_size=CACHE_SIZE):
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = {}
+
+    def to_epoch_ms(self, text):
+        epoch_ms = self._cache.get(text)
+        if epoch_ms is not None:
+            self.hits += 1
+            return epoch_ms
+        self.misses += 1
+        epoch_ms = parse_utc_time_ms(text)
+        if len(self._cache) >= self.cache_size:
+            self._cache.clear()  # Frame times only move forward, old entries are never asked for again
+        self._cache[text] = epoch_ms
+        return epoch_ms
+
+    def stats(self):
+        return {"cache_hits": self.hits, "cache_misses": self.misses}